@@ -0,0 +1,95 @@
+# backup_scheduler.py  – debounced per-user backups of embedding stores
+import asyncio
+import time
+
+import metrics
+
+class BackupScheduler:
+    """
+    Marks users dirty and runs `upload_fn(uid)` for each at most once per `min_interval_seconds`.
+
+    However many updates land while a user is waiting (or while their upload runs),
+    they are covered by a single follow-up upload. A failed upload leaves the user dirty
+    and is retried, backing off up to `max_retry_seconds` between attempts.
+    """
+
+    def __init__(self, upload_fn, min_interval_seconds: float = 60.0, max_retry_seconds: float = 900.0):
+        self.upload_fn = upload_fn
+        self.min_interval_seconds = min_interval_seconds
+        self.max_retry_seconds = max_retry_seconds
+        self._dirty: set[str] = set()
+        self._tasks: dict[str, asyncio.Task] = {}
+        self._last_upload: dict[str, float] = {}
+        # uid -> consecutive failed uploads
+        self._failures: dict[str, int] = {}
+        self._uploading: set[str] = set()
+        self._closing = False
+
+    def _publish_depth(self):
+        metrics.set_gauge("backup_scheduler.dirty_users", len(self._dirty))
+
+    def mark_dirty(self, uid: str):
+        """Schedule a backup for `uid` unless one is already pending."""
+        self._dirty.add(uid)
+        metrics.incr("backup_scheduler.marked_dirty")
+        self._publish_depth()
+        if uid not in self._tasks:
+            self._tasks[uid] = asyncio.create_task(self._run(uid))
+
+    def is_pending(self, uid: str) -> bool:
+        """True while `uid` has changes that are not (yet) in blob storage."""
+        return uid in self._dirty or uid in self._uploading
+
+    async def _run(self, uid: str):
+        try:
+            while uid in self._dirty and not self._closing:
+                due = self._last_upload.get(uid, 0.0) + self._wait_seconds(uid)
+                delay = due - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                await self._upload(uid)
+        finally:
+            self._tasks.pop(uid, None)
+
+    def _wait_seconds(self, uid: str) -> float:
+        failures = self._failures.get(uid, 0)
+        if failures == 0:
+            return self.min_interval_seconds
+        retry = min(max(self.min_interval_seconds, 1.0) * 2 ** (failures - 1), self.max_retry_seconds)
+        return max(self.min_interval_seconds, retry)
+
+    async def _upload(self, uid: str):
+        self._dirty.discard(uid)
+        self._publish_depth()
+        self._last_upload[uid] = time.monotonic()
+        self._uploading.add(uid)
+        try:
+            with metrics.timer("backup_scheduler.upload_seconds"):
+                await self.upload_fn(uid)
+            metrics.incr("backup_scheduler.uploads")
+            self._failures.pop(uid, None)
+        except Exception as e:
+            metrics.incr("backup_scheduler.upload_errors")
+            print(f"Error backing up embeddings for user {uid}: {e}")
+            # Still not in blob storage: stay dirty (so the store is not evicted) and try again later
+            self._failures[uid] = self._failures.get(uid, 0) + 1
+            self._dirty.add(uid)
+            self._publish_depth()
+        finally:
+            self._uploading.discard(uid)
+
+    async def flush_all(self):
+        """Upload every dirty user right away (used on graceful shutdown)."""
+        self._closing = True
+        # Let uploads already in flight finish, and skip the wait of everyone still debouncing
+        in_flight = []
+        for uid, task in list(self._tasks.items()):
+            if uid in self._uploading:
+                in_flight.append(task)
+            else:
+                task.cancel()
+                # A task cancelled before it started never reaches its own cleanup
+                self._tasks.pop(uid, None)
+        await asyncio.gather(*in_flight, return_exceptions=True)
+        for uid in list(self._dirty):
+            await self._upload(uid)
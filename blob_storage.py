@@ -0,0 +1,168 @@
+# blob_storage.py  – blob container backends (Azure or a local folder stand-in) with chunked reads
+import io
+import os
+from pathlib import Path
+
+from azure.core.exceptions import ResourceNotFoundError
+from azure.storage.blob import BlobServiceClient, ContentSettings
+
+from config import AZURE_BLOB_CONNECTION_STR, EMBEDDINGS_CONTAINER_NAME, BLOB_BACKEND, LOCAL_BLOB_DIR, BLOB_STREAM_CHUNK_SIZE
+
+class AzureBlobContainer:
+    """Thin wrapper over one Azure Blob Storage container."""
+
+    def __init__(self, connection_str: str, container_name: str):
+        self.container_name = container_name
+        self._container_client = BlobServiceClient.from_connection_string(connection_str).get_container_client(container_name)
+
+    def _blob(self, blob_name: str):
+        return self._container_client.get_blob_client(blob_name)
+
+    def exists(self, blob_name: str) -> bool:
+        return self._blob(blob_name).exists()
+
+    def size(self, blob_name: str) -> int:
+        return self._blob(blob_name).get_blob_properties().size
+
+    def url(self, blob_name: str) -> str:
+        return self._blob(blob_name).url
+
+    def upload_bytes(self, blob_name: str, data: bytes, content_type: str = "application/octet-stream"):
+        self._blob(blob_name).upload_blob(
+            data,
+            overwrite=True,
+            blob_type="BlockBlob",
+            content_settings=ContentSettings(content_type=content_type, content_disposition="inline"),
+        )
+
+    def delete(self, blob_name: str):
+        try:
+            self._blob(blob_name).delete_blob()
+        except ResourceNotFoundError:
+            pass
+
+    def list_names(self, prefix: str = ""):
+        for blob in self._container_client.list_blobs(name_starts_with=prefix or None):
+            yield blob.name
+
+    def read_range(self, blob_name: str, offset: int, length: int) -> bytes:
+        return self._blob(blob_name).download_blob(offset=offset, length=length).readall()
+
+    def iter_chunks(self, blob_name: str, chunk_size: int = BLOB_STREAM_CHUNK_SIZE):
+        blob_size = self.size(blob_name)
+        for offset in range(0, blob_size, chunk_size):
+            yield self.read_range(blob_name, offset, min(chunk_size, blob_size - offset))
+
+
+class LocalBlobContainer:
+    """Blob container stand-in backed by a local folder (for tests and isolated boxes)."""
+
+    def __init__(self, root: str, container_name: str):
+        self.container_name = container_name
+        self.root = Path(root) / container_name
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, blob_name: str) -> Path:
+        return self.root / blob_name
+
+    def exists(self, blob_name: str) -> bool:
+        return self._path(blob_name).is_file()
+
+    def size(self, blob_name: str) -> int:
+        return self._path(blob_name).stat().st_size
+
+    def url(self, blob_name: str) -> str:
+        return self._path(blob_name).resolve().as_uri()
+
+    def upload_bytes(self, blob_name: str, data: bytes, content_type: str = "application/octet-stream"):
+        path = self._path(blob_name)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(path.name + ".uploading")
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        # Readers never see a partially written blob
+        os.replace(tmp_path, path)
+
+    def delete(self, blob_name: str):
+        self._path(blob_name).unlink(missing_ok=True)
+
+    def list_names(self, prefix: str = ""):
+        for path in self.root.rglob("*"):
+            name = path.relative_to(self.root).as_posix()
+            if path.is_file() and name.startswith(prefix) and not name.endswith(".uploading"):
+                yield name
+
+    def read_range(self, blob_name: str, offset: int, length: int) -> bytes:
+        with open(self._path(blob_name), "rb") as f:
+            f.seek(offset)
+            return f.read(length)
+
+    def iter_chunks(self, blob_name: str, chunk_size: int = BLOB_STREAM_CHUNK_SIZE):
+        with open(self._path(blob_name), "rb") as f:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+
+
+class BlobRangeReader(io.RawIOBase):
+    """
+    Seekable, read-only file object over a blob that fetches `chunk_size` byte ranges on demand.
+
+    Lets `zipfile` read an archive straight from blob storage while holding at most one chunk.
+    """
+
+    def __init__(self, container, blob_name: str, chunk_size: int = BLOB_STREAM_CHUNK_SIZE):
+        self.container = container
+        self.blob_name = blob_name
+        self.chunk_size = max(1, chunk_size)
+        self._size = container.size(blob_name)
+        self._pos = 0
+        self._chunk_start = 0
+        self._chunk = b""
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._pos
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_SET:
+            self._pos = offset
+        elif whence == io.SEEK_CUR:
+            self._pos += offset
+        elif whence == io.SEEK_END:
+            self._pos = self._size + offset
+        else:
+            raise ValueError(f"Invalid whence: {whence}")
+        self._pos = max(0, self._pos)
+        return self._pos
+
+    def readinto(self, buffer) -> int:
+        if self._pos >= self._size:
+            return 0
+        if not (self._chunk_start <= self._pos < self._chunk_start + len(self._chunk)):
+            self._chunk_start = self._pos
+            self._chunk = self.container.read_range(self.blob_name, self._pos, min(self.chunk_size, self._size - self._pos))
+        start = self._pos - self._chunk_start
+        data = self._chunk[start:start + len(buffer)]
+        buffer[:len(data)] = data
+        self._pos += len(data)
+        return len(data)
+
+
+_containers = {}
+
+def get_blob_container(container_name: str = EMBEDDINGS_CONTAINER_NAME):
+    """Return the (cached) container client for the configured BLOB_BACKEND."""
+    if container_name not in _containers:
+        if BLOB_BACKEND == "local":
+            _containers[container_name] = LocalBlobContainer(LOCAL_BLOB_DIR, container_name)
+        else:
+            _containers[container_name] = AzureBlobContainer(AZURE_BLOB_CONNECTION_STR, container_name)
+    return _containers[container_name]
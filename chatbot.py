@@ -1,5 +1,4 @@
 from langchain_core.messages import  HumanMessage
-from langchain_openai import ChatOpenAI
 from langchain.prompts.chat import (
     ChatPromptTemplate,
     SystemMessagePromptTemplate,
@@ -7,18 +6,20 @@ from langchain.prompts.chat import (
 )
 import re
 import json
+import asyncio
 from openai import OpenAI
 from datetime import datetime
 
 
 from utils import dict_to_string, add_extracted_data_to_db, remove_stage_from_message, extract_dictionary_from_string, clean_and_parse_json
 from core.chatActions import add_chat_to_db, get_chat_from_db
-from config import OPENAI_API_KEY
+from model_backends import get_chat_model
+from llm_runner import LLM_RUNNER
 
 def get_todays_date_formatted():
     return datetime.today().strftime('%Y-%m-%d')
 
-LLM = ChatOpenAI(api_key=OPENAI_API_KEY, model_name="gpt-4o-mini", temperature=0.0)
+LLM = get_chat_model("gpt-4o-mini", temperature=0.0)
 
 def get_chat_history_for_ai(uid, session_id):
     chat_history, count = get_chat_from_db(uid, session_id)
@@ -49,8 +50,8 @@ def extract_stage_from_message(message):
         print("Error: No stage found in the input string.")
         return None
 
-def MindWavebot(uid, session_id:str, message:str, system_template, verbosity=1):
-    add_chat_to_db(uid, session_id, "user", message, message, {})
+async def MindWavebot(uid, session_id:str, message:str, system_template, verbosity=1):
+    await asyncio.to_thread(add_chat_to_db, uid, session_id, "user", message, message, {})
     
     sys_message = SystemMessagePromptTemplate.from_template(system_template)
     #print(sys_message)
@@ -63,12 +64,12 @@ def MindWavebot(uid, session_id:str, message:str, system_template, verbosity=1):
     
     chain = chat_prompts | LLM
     
-    session_chat_history = get_chat_history_for_ai(uid, session_id)
+    session_chat_history = await asyncio.to_thread(get_chat_history_for_ai, uid, session_id)
 
     # print("Session chat history:", session_chat_history)
 
-    model_response = chain.invoke(
-            {"input": message, "chat_history": session_chat_history}
+    model_response = await LLM_RUNNER.ainvoke(
+            "assessment_chat", chain, {"input": message, "chat_history": session_chat_history}
         )
     #print("Model response:", model_response.content)
     #print("Extracting dictionary from diana_response.content 1")
@@ -81,9 +82,9 @@ def MindWavebot(uid, session_id:str, message:str, system_template, verbosity=1):
 
         print("Extracted dictionary:", dictionary_response)
         
-        add_chat_to_db(uid, session_id, "system", model_response.content,"I think I've gotten enough data",{"details_completed":True},)
+        await asyncio.to_thread(add_chat_to_db, uid, session_id, "system", model_response.content,"I think I've gotten enough data",{"details_completed":True},)
         print("Added chat to DB with session_id:", session_id)
-        add_extracted_data_to_db(uid, session_id, dictionary_response)
+        await asyncio.to_thread(add_extracted_data_to_db, uid, session_id, dictionary_response)
         return {
             "message": "I think I've gotten enough data",
             "type" : "system",
@@ -103,10 +104,10 @@ def MindWavebot(uid, session_id:str, message:str, system_template, verbosity=1):
         output["type"] = "system"
         output["stages"] = stages
 
-        add_chat_to_db(uid, session_id, "system", model_response.content, output["message"], {'stages': stages, 'details_completed': False})
+        await asyncio.to_thread(add_chat_to_db, uid, session_id, "system", model_response.content, output["message"], {'stages': stages, 'details_completed': False})
         return output
 
-def MindwaveReportBot(uid, session_id:str, prediction:str, required_info:str, curr_test,data_extracted=None, previous_report=None):
+async def MindwaveReportBot(uid, session_id:str, prediction:str, required_info:str, curr_test,data_extracted=None, previous_report=None):
     
     required_info_s = required_info
   
@@ -155,10 +156,10 @@ def MindwaveReportBot(uid, session_id:str, prediction:str, required_info:str, cu
     
     chain = chat_prompts | LLM
     
-    session_chat_history = get_chat_history_for_ai(uid, session_id)
+    session_chat_history = await asyncio.to_thread(get_chat_history_for_ai, uid, session_id)
 
-    model_response = chain.invoke(
-            {"chat_history": session_chat_history}
+    model_response = await LLM_RUNNER.ainvoke(
+            "assessment_report", chain, {"chat_history": session_chat_history}
         )
     
     return model_response.content
\ No newline at end of file
@@ -0,0 +1,37 @@
+"""
+Compact user vector stores on demand (the app also compacts grown stores on a schedule).
+
+Usage:
+    python compact_vector_stores.py [uid ...]
+
+Without uids every store folder under EMBEDDINGS_DIR is compacted. Changed stores are
+backed up before the script exits.
+"""
+import argparse
+import asyncio
+
+import ragImplementation as rag
+from local_tier import STAGING_SUFFIXES
+
+async def compact(user_ids):
+    if not user_ids:
+        user_ids = sorted(p.name for p in rag.EMBEDDING_DIR_PATH.iterdir() if p.is_dir() and not p.name.endswith(STAGING_SUFFIXES))
+
+    chunks_removed = 0
+    bytes_reclaimed = 0
+    for user_id in user_ids:
+        stats = await rag.compact_user_store(user_id)
+        if stats is None:
+            print(f"Skipping {user_id}: no local store")
+            continue
+        chunks_removed += stats["chunks_before"] - stats["chunks_after"]
+        bytes_reclaimed += stats["bytes_reclaimed"]
+
+    await rag.flush_pending_backups()
+    print(f"Compacted {len(user_ids)} users: {chunks_removed} chunks removed, {bytes_reclaimed} bytes reclaimed")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compact user vector stores.")
+    parser.add_argument("user_ids", nargs="*", help="User ids to compact (default: every local store)")
+    args = parser.parse_args()
+    asyncio.run(compact(args.user_ids))
@@ -0,0 +1,166 @@
+# compaction.py  – plans the compaction of a user's store: drops duplicate chunks, rolls event chunks up
+import asyncio
+import hashlib
+import time
+from datetime import datetime
+
+from langchain.docstore.document import Document
+
+import metrics
+
+# Event documents that pile up one chunk per occurrence, keyed by their title (the first line
+# of the chunk). `timestamp_key` is the metadata field holding when the event happened and also
+# identifies the event's chunks when the title is not on them (older chunks, or later splits).
+ROLLUP_RULES = {
+    "User Login": {"timestamp_key": "login_time", "group_by": "month"},
+    "Talk Session Data": {"timestamp_key": "talk session date", "group_by": "session"},
+}
+EVENT_SOURCE = "user_update"
+
+def _event_title(text: str, metadata: dict):
+    """Return the ROLLUP_RULES title of an event chunk, or None for every other chunk."""
+    if metadata.get("source") != EVENT_SOURCE or metadata.get("rollup"):
+        return None
+    title = metadata.get("title") or text.split("\n", 1)[0]
+    if title in ROLLUP_RULES:
+        return title
+    for title, rule in ROLLUP_RULES.items():
+        if rule["timestamp_key"] in metadata:
+            return title
+    return None
+
+def _event_time(metadata: dict, timestamp_key: str):
+    try:
+        return datetime.fromisoformat(metadata[timestamp_key])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+def _strip_title(text: str, title: str) -> str:
+    if text.startswith(title + "\n"):
+        return text[len(title) + 1:]
+    return text
+
+def plan_compaction(ids, documents, metadatas, now: datetime, session_idle_seconds: float) -> dict:
+    """
+    Work out how to compact one user's chunks.
+
+    - Chunks with exactly the same text are kept once.
+    - Event chunks of a closed period are merged into one rollup document per period: logins
+      per calendar month (once the month is over), talk turns per session (once the session has
+      been idle for `session_idle_seconds`). Events of the current period stay as they are.
+
+    Returns:
+        dict: `drop_ids` (chunks to delete), `rollups` (Documents to add, not yet split)
+              and counts of what was found.
+    """
+    seen_texts = set()
+    drop_ids = []
+    duplicates = 0
+    groups = {}
+
+    for chunk_id, text, metadata in zip(ids, documents, metadatas):
+        metadata = metadata or {}
+        text_hash = hashlib.sha256((text or "").encode("utf-8")).hexdigest()
+        if text_hash in seen_texts:
+            drop_ids.append(chunk_id)
+            duplicates += 1
+            continue
+        seen_texts.add(text_hash)
+
+        title = _event_title(text or "", metadata)
+        if title is None:
+            continue
+        rule = ROLLUP_RULES[title]
+        event_time = _event_time(metadata, rule["timestamp_key"])
+        if event_time is None:
+            continue
+        if rule["group_by"] == "month":
+            group_key = event_time.strftime("%Y-%m")
+        else:
+            group_key = metadata.get("curr_session_id") or event_time.strftime("%Y-%m-%d")
+        groups.setdefault((title, group_key), []).append((event_time, chunk_id, text, metadata))
+
+    rollups = []
+    rolled_up = 0
+    current_month = now.strftime("%Y-%m")
+    for (title, group_key), events in groups.items():
+        if len(events) < 2:
+            continue
+        events.sort(key=lambda event: event[0])
+        first, last = events[0][0], events[-1][0]
+        if ROLLUP_RULES[title]["group_by"] == "month":
+            if group_key >= current_month:
+                continue
+            label = group_key
+        else:
+            if (now - last).total_seconds() < session_idle_seconds:
+                continue
+            label = f"session {group_key}"
+
+        body = "\n\n".join(_strip_title(text, title).strip() for _, _, text, _ in events)
+        rollups.append(Document(
+            page_content=f"{title} ({label}, {len(events)} entries from {first.isoformat()} to {last.isoformat()})\n{body}",
+            metadata={
+                "source": EVENT_SOURCE,
+                "title": title,
+                "rollup": True,
+                "event_count": len(events),
+                "period_start": first.isoformat(),
+                "period_end": last.isoformat(),
+                "curr_session_id": events[-1][3].get("curr_session_id", ""),
+            },
+        ))
+        drop_ids.extend(chunk_id for _, chunk_id, _, _ in events)
+        rolled_up += len(events)
+
+    return {
+        "drop_ids": drop_ids,
+        "rollups": rollups,
+        "duplicates_dropped": duplicates,
+        "events_rolled_up": rolled_up,
+    }
+
+
+class CompactionScheduler:
+    """
+    Runs `compact_fn(uid)` (async) for users whose stores grew by at least `min_new_chunks`
+    since their last compaction, at most once per `min_interval_seconds` per user.
+    """
+
+    def __init__(self, compact_fn, min_interval_seconds: float = 86400.0, min_new_chunks: int = 20):
+        self.compact_fn = compact_fn
+        self.min_interval_seconds = min_interval_seconds
+        self.min_new_chunks = min_new_chunks
+        self._new_chunks: dict[str, int] = {}
+        self._last_run: dict[str, float] = {}
+
+    def note_writes(self, uid: str, chunk_count: int):
+        """Record that `chunk_count` chunks were just added to `uid`'s store."""
+        self._new_chunks[uid] = self._new_chunks.get(uid, 0) + chunk_count
+
+    def due_users(self) -> list[str]:
+        now = time.monotonic()
+        return [
+            uid for uid, count in self._new_chunks.items()
+            if count >= self.min_new_chunks and now - self._last_run.get(uid, float("-inf")) >= self.min_interval_seconds
+        ]
+
+    async def run_due(self) -> int:
+        """Compact every due user one after the other; returns how many were compacted."""
+        compacted = 0
+        for uid in self.due_users():
+            self._last_run[uid] = time.monotonic()
+            self._new_chunks.pop(uid, None)
+            try:
+                await self.compact_fn(uid)
+                compacted += 1
+            except Exception as e:
+                metrics.incr("compaction.errors")
+                print(f"Error compacting embeddings for user {uid}: {e}")
+        return compacted
+
+    async def run_forever(self, interval_seconds: float):
+        """Check for due users every `interval_seconds` until cancelled."""
+        while True:
+            await asyncio.sleep(interval_seconds)
+            await self.run_due()
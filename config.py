@@ -15,8 +15,108 @@ EMBEDDINGS_DIR = os.getenv("EMBEDDINGS_DIR", "embeddings")
 if not os.path.exists(EMBEDDINGS_DIR):
     os.makedirs(EMBEDDINGS_DIR)
 
+# "per_user" keeps one Chroma folder per user under EMBEDDINGS_DIR, "shared" keeps every user in one
+# collection under SHARED_STORE_DIR with retrieval filtered by the chunk's uid metadata
+VECTOR_STORE_MODE = os.getenv("VECTOR_STORE_MODE", "per_user")
+SHARED_STORE_DIR = os.getenv("SHARED_STORE_DIR", "shared_embeddings")
+
+# Per-user stores with at most this many chunks are searched with a memory-mapped NumPy index
+# instead of Chroma (0 disables it); the index files live under NUMPY_INDEX_DIR
+NUMPY_RETRIEVER_MAX_CHUNKS = int(os.getenv("NUMPY_RETRIEVER_MAX_CHUNKS", 2000))
+NUMPY_INDEX_DIR = os.getenv("NUMPY_INDEX_DIR", "numpy_indexes")
+
+# Per-user vector store handle cache
+STORE_CACHE_SIZE = int(os.getenv("STORE_CACHE_SIZE", 128))
+STORE_CACHE_IDLE_SECONDS = float(os.getenv("STORE_CACHE_IDLE_SECONDS", 900))
+
+# Local disk budget for per-user store folders (and their NumPy indexes); cold users that are backed up get evicted
+LOCAL_STORE_DISK_BUDGET_BYTES = int(os.getenv("LOCAL_STORE_DISK_BUDGET_MB", 2048)) * 1024 * 1024
+LOCAL_STORE_MIN_IDLE_SECONDS = float(os.getenv("LOCAL_STORE_MIN_IDLE_SECONDS", 600))
+LOCAL_STORE_SWEEP_SECONDS = float(os.getenv("LOCAL_STORE_SWEEP_SECONDS", 300))
+
+# Retrieved documents cached per (uid, store version, query)
+RETRIEVAL_CACHE_SIZE = int(os.getenv("RETRIEVAL_CACHE_SIZE", 1024))
+RETRIEVAL_CACHE_TTL_SECONDS = float(os.getenv("RETRIEVAL_CACHE_TTL_SECONDS", 600))
+
+# Store locks: "process" (asyncio locks, one worker) or "file" (OS file locks under LOCK_DIR,
+# for several workers sharing one embeddings volume)
+LOCK_BACKEND = os.getenv("LOCK_BACKEND", "process")
+LOCK_DIR = os.getenv("LOCK_DIR", "store_locks")
+
+# Serve the /common/locks and /common/llm debug endpoints (off unless set to "true")
+DEBUG_ENDPOINTS_ENABLED = os.getenv("DEBUG_ENDPOINTS_ENABLED", "false").lower() == "true"
+
+# How many user stores may be warmed up (restored/opened after login) at the same time
+WARMUP_CONCURRENCY = int(os.getenv("WARMUP_CONCURRENCY", 2))
+
+# Model backends: "openai", or offline fakes for load tests ("hashing" embeddings, "scripted" chat model)
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "openai")
+HASHING_EMBEDDING_DIM = int(os.getenv("HASHING_EMBEDDING_DIM", 1536))
+LLM_BACKEND = os.getenv("LLM_BACKEND", "openai")
+SCRIPTED_LLM_LATENCY_SECONDS = float(os.getenv("SCRIPTED_LLM_LATENCY_SECONDS", 0.0))
+SCRIPTED_LLM_TOKEN_SECONDS = float(os.getenv("SCRIPTED_LLM_TOKEN_SECONDS", 0.0))
+SCRIPTED_LLM_OUTPUT_TOKENS = int(os.getenv("SCRIPTED_LLM_OUTPUT_TOKENS", 0))
+# Optional JSON file: a list of replies (used in turn) or {prompt substring: reply, "default": reply}
+SCRIPTED_LLM_RESPONSES_FILE = os.getenv("SCRIPTED_LLM_RESPONSES_FILE", "")
+
+# LLM calls: per-call timeout (seconds; for streams, the longest gap between chunks), the default
+# number of concurrent calls per flow, and per-flow overrides as "flow=limit,flow=limit"
+LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", 60))
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", 32))
+LLM_FLOW_CONCURRENCY = os.getenv("LLM_FLOW_CONCURRENCY", "")
+
+# Talk-session memory: the last TALK_HISTORY_WINDOW_TURNS turns go to the model verbatim, older
+# ones as a rolling summary (of at most TALK_SUMMARY_MAX_WORDS words) kept on the session. The
+# summary is refreshed once TALK_SUMMARY_BATCH_TURNS more turns have overflowed the window.
+TALK_HISTORY_WINDOW_TURNS = int(os.getenv("TALK_HISTORY_WINDOW_TURNS", 6))
+TALK_SUMMARY_BATCH_TURNS = int(os.getenv("TALK_SUMMARY_BATCH_TURNS", 4))
+TALK_SUMMARY_MAX_WORDS = int(os.getenv("TALK_SUMMARY_MAX_WORDS", 250))
+
+# Transcripts of active chat sessions kept in memory (sessions, idle TTL, and the longest transcript kept)
+TRANSCRIPT_CACHE_SESSIONS = int(os.getenv("TRANSCRIPT_CACHE_SESSIONS", 1024))
+TRANSCRIPT_CACHE_IDLE_SECONDS = float(os.getenv("TRANSCRIPT_CACHE_IDLE_SECONDS", 1800))
+TRANSCRIPT_CACHE_MAX_MESSAGES = int(os.getenv("TRANSCRIPT_CACHE_MAX_MESSAGES", 500))
+
+# Content-hash embedding cache (float32 vectors on disk + in-memory LRU front)
+EMBEDDING_CACHE_DIR = os.getenv("EMBEDDING_CACHE_DIR", "embedding_cache")
+EMBEDDING_CACHE_MEMORY_ITEMS = int(os.getenv("EMBEDDING_CACHE_MEMORY_ITEMS", 20000))
+# Vectors kept in the SQLite file (about 6KB each at 1536 dimensions); the oldest written are pruned past it
+EMBEDDING_CACHE_MAX_ROWS = int(os.getenv("EMBEDDING_CACHE_MAX_ROWS", 50000))
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", 512))
+
+# Process-wide batching of embedding provider calls across users
+EMBEDDING_BATCH_WINDOW_SECONDS = float(os.getenv("EMBEDDING_BATCH_WINDOW_SECONDS", 0.01))
+EMBEDDING_BATCH_MAX_SIZE = int(os.getenv("EMBEDDING_BATCH_MAX_SIZE", 1000))
+EMBEDDING_MAX_IN_FLIGHT = int(os.getenv("EMBEDDING_MAX_IN_FLIGHT", 4))
+
+# Chunks embedded and written per batch when ingesting docs (bounds memory of large rebuilds)
+INGEST_BATCH_CHUNKS = int(os.getenv("INGEST_BATCH_CHUNKS", 256))
+
+# Write-behind buffering of per-user embedding updates
+EMBEDDING_WRITE_BEHIND_SECONDS = float(os.getenv("EMBEDDING_WRITE_BEHIND_SECONDS", 2.0))
+EMBEDDING_WRITE_BEHIND_MAX_DOCS = int(os.getenv("EMBEDDING_WRITE_BEHIND_MAX_DOCS", 16))
+
+# Compaction of user stores: duplicate chunks are dropped and old login/talk events rolled up
+COMPACTION_SWEEP_SECONDS = float(os.getenv("COMPACTION_SWEEP_SECONDS", 600))
+COMPACTION_MIN_INTERVAL_SECONDS = float(os.getenv("COMPACTION_MIN_INTERVAL_SECONDS", 86400))
+COMPACTION_MIN_NEW_CHUNKS = int(os.getenv("COMPACTION_MIN_NEW_CHUNKS", 20))
+COMPACTION_SESSION_IDLE_SECONDS = float(os.getenv("COMPACTION_SESSION_IDLE_SECONDS", 86400))
+
 AZURE_BLOB_CONNECTION_STR = os.getenv("BLOB_CONNECTION_STR", "")
 EMBEDDINGS_CONTAINER_NAME = os.getenv("EMBEDDINGS_CONTAINER_NAME", "embeddings")
+# "azure" or "local" - the local backend keeps blobs under LOCAL_BLOB_DIR, e.g. for tests
+BLOB_BACKEND = os.getenv("BLOB_BACKEND", "azure")
+LOCAL_BLOB_DIR = os.getenv("LOCAL_BLOB_DIR", "local_blobs")
+# Upper bound on how much of a blob is held in memory while streaming it
+BLOB_STREAM_CHUNK_SIZE = int(os.getenv("BLOB_STREAM_CHUNK_SIZE", 4 * 1024 * 1024))
+# Store backups are split into content-addressed segments of this many bytes
+BACKUP_SEGMENT_SIZE = int(os.getenv("BACKUP_SEGMENT_SIZE", 256 * 1024))
+# A user's store is backed up at most once per this many seconds, however often it changes
+BACKUP_MIN_INTERVAL_SECONDS = float(os.getenv("BACKUP_MIN_INTERVAL_SECONDS", 60))
+# Backups are portable snapshots (vector matrix + JSON lines records) with vectors stored as
+# "float16" (half the size) or "float32" (exact); they are staged under SNAPSHOT_DIR
+SNAPSHOT_DTYPE = os.getenv("SNAPSHOT_DTYPE", "float16")
+SNAPSHOT_DIR = os.getenv("SNAPSHOT_DIR", "store_snapshots")
 
 QLOO_API_URL = os.getenv("QLOO_API_URL", "https://api.qloo.com/v1/recommendations")
 QLOO_API_KEY = os.getenv("QLOO_API_KEY", "")
@@ -1,4 +1,4 @@
-from ragImplementation import create_embeddings_for_user, create_docs, update_embeddings_for_user
+from ragImplementation import init_user_store, create_docs, update_embeddings_for_user, start_user_store_warmup
 from core.userActions import add_recommendations, confirm_to_add_more_alonis_recommendations
 from core.recommendations import get_alonis_recommendations, get_alonis_qloo_powered_recommendations
 import asyncio
@@ -39,8 +39,15 @@ async def init_user_embeddings(user_data: str):
     # Extract user_id from user_data
     user_id = user_data.get('uid', 'default_user')
 
-    # Create embeddings for the user
-    await create_embeddings_for_user(docs, user_id)
+    # Create embeddings for the user (shares any restore/rebuild a racing request already started)
+    await init_user_store(docs, user_id)
+
+def warm_user_embeddings(user_id: str):
+    """
+    Start restoring/opening the user's embeddings store in the background at login, so the
+    first talk or quote request finds it warm instead of downloading it while the user waits.
+    """
+    return start_user_store_warmup(user_id)
 
 async def update_user_embeddings(data, user_id: str, meta_data = {}, session_id = "", title = "Context Data"):
     """
@@ -52,6 +59,7 @@ async def update_user_embeddings(data, user_id: str, meta_data = {}, session_id
             title: {"content" : await asyncio.to_thread(serialize_dict_to_text, data, 2) if isinstance(data, dict) else data,
                     'metadata': {
                         'source': 'user_update',
+                        'title': title,
                         **meta_data
                     }
                 }
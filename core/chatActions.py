@@ -1,5 +1,38 @@
 from db import messageCollection, sessionsCollection, talksMessagesCollection
 from datetime import datetime
+from config import TRANSCRIPT_CACHE_SESSIONS, TRANSCRIPT_CACHE_IDLE_SECONDS, TRANSCRIPT_CACHE_MAX_MESSAGES
+from transcript_cache import TranscriptCache
+
+# Active sessions' transcripts: loaded once, then appended to by add_chat_to_db
+TRANSCRIPT_CACHE = TranscriptCache(
+    max_sessions=TRANSCRIPT_CACHE_SESSIONS,
+    idle_seconds=TRANSCRIPT_CACHE_IDLE_SECONDS,
+    max_messages=TRANSCRIPT_CACHE_MAX_MESSAGES
+)
+
+def _transcript_key(uid, session_id, talks_session):
+    return f"{'talk' if talks_session else 'chat'}:{uid}:{session_id}"
+
+def get_session_transcript(uid, session_id, talks_session=False, start=0):
+    """
+    The messages of a session after the first `start`, oldest first. Served from the transcript cache
+    when it holds the session (and the session's message_count shows no other worker added messages
+    since); otherwise only those messages are read from the DB, and a full read is cached.
+    """
+    collection = talksMessagesCollection if talks_session else messageCollection
+    key = _transcript_key(uid, session_id, talks_session)
+    session = sessionsCollection.find_one({"uid": uid, "session_id": session_id}, {"_id": 0, "message_count": 1})
+    expected_length = (session or {}).get("message_count", 0)
+    if start > 0:
+        transcript = TRANSCRIPT_CACHE.get(key, expected_length=expected_length)
+        if transcript is not None:
+            return transcript[start:]
+        return list(collection.find({"uid":uid, "session_id": session_id}, {"_id": 0}).sort("date", 1).skip(start))
+    return TRANSCRIPT_CACHE.load(
+        key,
+        lambda: collection.find({"uid":uid, "session_id": session_id}, {"_id": 0}).sort("date", 1),
+        expected_length=expected_length
+    )
     
 def add_chat_to_db(uid, session_id:str,type:str,message:str, clean_message = "", extra_info={}, talks_session=False):
     if clean_message == "":
@@ -18,6 +51,8 @@ def add_chat_to_db(uid, session_id:str,type:str,message:str, clean_message = "",
         talksMessagesCollection.insert_one(document)
     else:
         messageCollection.insert_one(document)
+    # insert_one adds the ObjectId to the document, transcripts are read without it
+    TRANSCRIPT_CACHE.append(_transcript_key(uid, session_id, talks_session), {k: v for k, v in document.items() if k != "_id"})
     
     # Lets also update the session to increase the message count or initialze the variable to 1 if it doesn't exist
     sessionsCollection.find_one_and_update(
@@ -27,25 +62,12 @@ def add_chat_to_db(uid, session_id:str,type:str,message:str, clean_message = "",
     )
     
 def get_chat_from_db(uid, session_id, talks_session=False, getCount = False):
-    if talks_session:
-        try:
-            chats = talksMessagesCollection.find({"uid":uid, "session_id": session_id}, {"_id": 0})
-            if getCount:
-                count = talksMessagesCollection.count_documents({"uid":uid, "session_id": session_id})
-                return list(chats), count
-            else:
-                return	chats, None
-        except Exception as e:
-            print(e)
-            return "Error with chat retrieval", None
-    else:
-        try:
-            chats = messageCollection.find({"uid":uid, "session_id": session_id}, {"_id": 0})
-            if getCount:
-                count = messageCollection.count_documents({"uid":uid, "session_id": session_id})
-                return list(chats), count
-            else:
-                return chats, None
-        except Exception as e:
-            print(e)
-            return "Error with chat retrieval", None
\ No newline at end of file
+    try:
+        chats = get_session_transcript(uid, session_id, talks_session)
+        if getCount:
+            return chats, len(chats)
+        else:
+            return chats, None
+    except Exception as e:
+        print(e)
+        return "Error with chat retrieval", None
\ No newline at end of file
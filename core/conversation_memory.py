@@ -0,0 +1,100 @@
+# conversation_memory.py  – bounded talk-session history: the last turns verbatim plus a rolling summary of older ones
+import asyncio
+from datetime import datetime
+
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.prompts import ChatPromptTemplate
+
+import metrics
+import model_prompts
+import ragImplementation as rag
+from config import TALK_HISTORY_WINDOW_TURNS, TALK_SUMMARY_BATCH_TURNS, TALK_SUMMARY_MAX_WORDS
+from core.chatActions import get_session_transcript
+from db import sessionsCollection
+from llm_runner import LLM_RUNNER
+from single_flight import SingleFlight
+
+# Field of the session document holding {"summary", "summarized_count", "updated_at"}
+MEMORY_FIELD = "talk_memory"
+
+# A turn is the user's message and the reply to it
+WINDOW_MESSAGES = 2 * TALK_HISTORY_WINDOW_TURNS
+# Never more than this many messages verbatim, even while a summary refresh is behind
+MAX_VERBATIM_MESSAGES = 2 * (TALK_HISTORY_WINDOW_TURNS + TALK_SUMMARY_BATCH_TURNS)
+
+SUMMARY_CHAIN = ChatPromptTemplate.from_messages([
+    ("system", model_prompts.TALK_SUMMARY_PROMPT),
+    ("human", "{messages}"),
+]) | rag.FLOW_LLM | StrOutputParser()
+
+SUMMARY_FLIGHTS = SingleFlight(name="talk_memory_flight")
+
+def _session_memory(uid, session_id) -> dict:
+    session = sessionsCollection.find_one({"uid": uid, "session_id": session_id}, {"_id": 0, MEMORY_FIELD: 1})
+    return (session or {}).get(MEMORY_FIELD) or {"summary": "", "summarized_count": 0}
+
+def _unsummarized_messages(uid, session_id, summarized_count: int) -> list:
+    """The session's messages after the first `summarized_count` (the ones already in the summary), oldest first."""
+    return get_session_transcript(uid, session_id, talks_session=True, start=summarized_count)
+
+def _render(messages) -> str:
+    lines = []
+    for message in messages:
+        speaker = "User" if message.get("type") in ("user", "human") else "ALONIS"
+        lines.append(f"{speaker}: {message.get('message', '')}")
+    return "\n".join(lines)
+
+def build_history(uid, session_id) -> str:
+    """
+    Chat history for the talk prompt: the session summary (if any) followed by the most recent
+    messages, so its size stays bounded however long the session gets.
+    """
+    memory = _session_memory(uid, session_id)
+    recent = _unsummarized_messages(uid, session_id, memory["summarized_count"])[-MAX_VERBATIM_MESSAGES:]
+    parts = []
+    if memory["summary"]:
+        parts.append(f"Summary of the earlier conversation:\n{memory['summary']}")
+    if recent:
+        parts.append(f"Most recent messages:\n{_render(recent)}")
+    return "\n\n".join(parts)
+
+async def _refresh_summary(uid, session_id) -> bool:
+    memory = await asyncio.to_thread(_session_memory, uid, session_id)
+    messages = await asyncio.to_thread(_unsummarized_messages, uid, session_id, memory["summarized_count"])
+    if len(messages) < WINDOW_MESSAGES + 2 * TALK_SUMMARY_BATCH_TURNS:
+        return False
+
+    overflow = messages[:-WINDOW_MESSAGES]
+    with metrics.timer("talk_memory.summary_seconds"):
+        summary = await LLM_RUNNER.ainvoke("talk_summary", SUMMARY_CHAIN, {
+            "summary": memory["summary"] or "No summary yet, this is the start of the conversation.",
+            "messages": _render(overflow),
+            "max_words": TALK_SUMMARY_MAX_WORDS,
+        })
+    summarized_count = memory["summarized_count"]
+    # Only move the summary forward from the state it was built on (another worker may have refreshed it)
+    result = await asyncio.to_thread(
+        sessionsCollection.update_one,
+        {"uid": uid, "session_id": session_id, f"{MEMORY_FIELD}.summarized_count": {"$in": [summarized_count] if summarized_count else [0, None]}},
+        {"$set": {MEMORY_FIELD: {
+            "summary": summary.strip(),
+            "summarized_count": summarized_count + len(overflow),
+            "updated_at": datetime.now(),
+        }}},
+    )
+    if result.modified_count == 0:
+        metrics.incr("talk_memory.refresh_conflicts")
+        return False
+    metrics.incr("talk_memory.refreshes")
+    return True
+
+async def refresh_summary(uid, session_id) -> bool:
+    """
+    Fold the turns that overflowed the verbatim window into the session summary, once at least
+    TALK_SUMMARY_BATCH_TURNS of them have piled up. Returns True if the summary was updated.
+    """
+    try:
+        return await SUMMARY_FLIGHTS.do(f"{uid}:{session_id}", lambda: _refresh_summary(uid, session_id))
+    except Exception as e:
+        print(f"Error refreshing talk session summary for user {uid}, session {session_id}: {e}")
+        return False
@@ -3,6 +3,7 @@ from utils import extract_list_from_string, dict_to_string
 from core.userActions import get_current_alonis_recommendations, get_user_page_for_qloo_recommendations, update_user_page_for_qloo_recommendations
 import random
 from core import qloo_core
+from llm_runner import LLM_RUNNER
 import asyncio
 
 async def get_alonis_recommendations(user_id, limit=10):
@@ -28,7 +29,7 @@ async def get_alonis_recommendations(user_id, limit=10):
         })
     )
 
-    recommendation_text  = model.invoke({"input": "Generate personalized recommendations based on the user's data and interactions."}).get("answer", "")
+    recommendation_text  = (await LLM_RUNNER.ainvoke("recommendation", model, {"input": "Generate personalized recommendations based on the user's data and interactions."})).get("answer", "")
 
     new_recommendations = await asyncio.to_thread(extract_list_from_string, recommendation_text)
 
@@ -75,7 +76,7 @@ async def get_alonis_qloo_powered_recommendations(user_id, rec_type='alonis_reco
             The recommendation tags including number of times that have been shown to user are {dict_to_string(current_page.get(rec_type, {})) if rec_type in current_page else "No previous tags shown to user."}
             """
         })
-        selected_tags_str = model.invoke({"input": "Select the tags that are appropriate for the user based on their data and past interactions."}).get("answer", "")
+        selected_tags_str = (await LLM_RUNNER.ainvoke("tag_selection", model, {"input": "Select the tags that are appropriate for the user based on their data and past interactions."})).get("answer", "")
         selected_tags = selected_tags_str.split(",") if selected_tags_str else []
         if selected_tags:
             selected_tags = [tag.strip() for tag in selected_tags if tag.strip().isdigit()]
@@ -118,7 +119,7 @@ async def get_alonis_qloo_powered_recommendations(user_id, rec_type='alonis_reco
         #     context_text = model.invoke({"input": "Generate a context for this recommendation based on the user's data and interactions."}).get("answer", "")
         #     rec['context'] = context_text
         #     rec['extra_data_string'] = dict_to_string(rec.get('extra_data', {}))
-        def enrich_recommendation(rec):
+        async def enrich_recommendation(rec):
             # copy the recommendation to avoid modifying the original
             rec_ = rec.copy()
             rec_['tags_original'] = None
@@ -128,13 +129,14 @@ async def get_alonis_qloo_powered_recommendations(user_id, rec_type='alonis_reco
                     {dict_to_string(rec_)}
                 """
             })
-            context_text = model.invoke({"input": "Generate a context for this recommendation based on the user's data and interactions."}).get("answer", "")
+            context_text = (await LLM_RUNNER.ainvoke("recommendation_context", model, {"input": "Generate a context for this recommendation based on the user's data and interactions."})).get("answer", "")
             rec['context'] = context_text
             rec['extra_data_string'] = dict_to_string(rec.get('extra_data', {}), normalize_text=True)
             return rec
         
+        # Runs as many at once as the recommendation_context flow's cap allows
         recommendations = await asyncio.gather(*[
-            asyncio.to_thread(enrich_recommendation, rec) for rec in recommendations
+            enrich_recommendation(rec) for rec in recommendations
         ])
 
         # Update the user page for Qloo recommendations
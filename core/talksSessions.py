@@ -1,24 +1,13 @@
+import asyncio
 import ragImplementation as rag
-from core.chatActions import add_chat_to_db, get_chat_from_db
-from langchain_core.messages import  HumanMessage
+from core import conversation_memory
+from core.chatActions import add_chat_to_db
 from utils import extract_dictionary_from_string, clean_and_parse_json
+from llm_runner import LLM_RUNNER
 
 def get_chat_history_for_ai(uid, session_id):
-    chat_history, count = get_chat_from_db(uid, session_id, talks_session=True)
-    new_messages = []
-    if not chat_history:
-        return new_messages
-    else:
-        for message in chat_history:
-            if message['type'] == 'human':
-                temp_message = message['message']
-                new_messages.append(HumanMessage(content=temp_message))
-            else:
-                # message = message['message']
-                temp_message = message['message']
-                new_messages.append(temp_message)
-
-        return new_messages
+    # Last turns verbatim plus a summary of the older ones, so long sessions don't grow the prompt
+    return conversation_memory.build_history(uid, session_id)
 
 def get_context_doc_list(context, session_id):
     return rag.create_docs(context, session_id)
@@ -34,6 +23,9 @@ def create_retriever(context_docs):
 async def load_retriever(uid):
     return await rag.load_user_retriever(uid)
 
+def record_first_response(uid):
+    rag.record_first_response_after_login(uid)
+
 def load_model(retriever, uid, session_id,flow_name = None, flow_context = None):
     if flow_name is not None and flow_context is not None:
         return rag.load_model(retriever, [], flow = {'name': flow_name, 
@@ -42,16 +34,31 @@ def load_model(retriever, uid, session_id,flow_name = None, flow_context = None)
         # If not in quote flow, we can use the chat history for the session
         return rag.load_model(retriever, get_chat_history_for_ai(uid, session_id))
 
-def letsTalk(message, model, uid, session_id):
+async def letsTalk(message, model, uid, session_id):
     add_chat_to_db(uid, session_id, "user", message, {}, talks_session=True)
-    response = model.invoke({"input": message})
+    response = await LLM_RUNNER.ainvoke("talk", model, {"input": message})
     answer = response["answer"]
     print("Answer:", answer)
     add_chat_to_db(uid, session_id, "system", answer, {}, talks_session=True)
+    asyncio.create_task(conversation_memory.refresh_summary(uid, session_id))
     return answer
 
-def getQuote(model, uid):
-    response = model.invoke({'input': "Give me a unique personalized quote for today"})
+async def letsTalkStream(message, model, uid, session_id):
+    """Like letsTalk, but yields the answer's tokens as they are generated; the full answer is saved once it is complete."""
+    add_chat_to_db(uid, session_id, "user", message, {}, talks_session=True)
+    answer_parts = []
+    async for chunk in LLM_RUNNER.astream("talk", model, {"input": message}):
+        token = chunk.get("answer")
+        if token:
+            answer_parts.append(token)
+            yield token
+    answer = "".join(answer_parts)
+    print("Answer:", answer)
+    add_chat_to_db(uid, session_id, "system", answer, {}, talks_session=True)
+    asyncio.create_task(conversation_memory.refresh_summary(uid, session_id))
+
+async def getQuote(model, uid):
+    response = await LLM_RUNNER.ainvoke("quote", model, {'input': "Give me a unique personalized quote for today"})
     quote_text = response["answer"]
 
     quote = extract_dictionary_from_string(quote_text)
@@ -65,8 +72,8 @@ def getQuote(model, uid):
         "uid": uid
     }
 
-def getStory(model, uid):
-    response = model.invoke({'input': "Give me a unique personalized story for today"})
+async def getStory(model, uid):
+    response = await LLM_RUNNER.ainvoke("story", model, {'input': "Give me a unique personalized story for today"})
     story_text = response["answer"]
 
     story = story_text.strip()
@@ -84,18 +91,24 @@ async def talkToMe(uid, session_id, message, context_doc_list= None):
         retriever = await load_retriever(uid)
 
     model = load_model(retriever, uid, session_id)
-    return letsTalk(message, model, uid, session_id)
+    return await letsTalk(message, model, uid, session_id)
+
+async def talkToMeStream(uid, session_id, message):
+    retriever = await load_retriever(uid)
+    model = load_model(retriever, uid, session_id)
+    async for token in letsTalkStream(message, model, uid, session_id):
+        yield token
 
 async def giveMeAQuoute(uid, previous_quotes=None):
     retriever = await load_retriever(uid)
     model = load_model(retriever, uid, None, flow_name='quote_flow', flow_context = f""" The past 10 previous quote seen by user are: 
                                                         {previous_quotes if previous_quotes else "No previous quotes available."}
                                                     """)
-    return getQuote(model, uid)
+    return await getQuote(model, uid)
 
 async def giveMeAStory(uid, previous_stories_text):
     retriever = await load_retriever(uid)
-    model = load_model(retriever, uid, None, flow_name='story_flow', flow_context=f""" The past 10 previous stories seen by user are: 
+    model = load_model(retriever, uid, None, flow_name='daily_story_flow', flow_context=f""" The past 10 previous stories seen by user are: 
                                                         {previous_stories_text if previous_stories_text else "No previous stories available."}
                                                     """)
-    return getStory(model, uid)
\ No newline at end of file
+    return await getStory(model, uid)
\ No newline at end of file
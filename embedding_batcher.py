@@ -0,0 +1,140 @@
+# embedding_batcher.py  – process-wide batching of embedding calls across concurrent users
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from langchain_core.embeddings import Embeddings
+
+import metrics
+
+class _Request:
+    def __init__(self, texts: list[str]):
+        self.texts = texts
+        self.vectors = [None] * len(texts)
+        self.remaining = len(texts)
+        self.future = Future()
+        self.queued_at = time.monotonic()
+
+
+class EmbeddingBatcher:
+    """
+    Collects texts from every caller (any thread) for up to `window_seconds` and sends them
+    to `embedder.embed_documents` in batches of up to `max_batch_size` texts, with at most
+    `max_in_flight` provider calls running at once. Each caller blocks until all of its own
+    vectors are back.
+
+    A batch is sent as soon as it is full, so the window only delays a quiet process. While
+    `max_in_flight` calls are running, new texts keep queueing and go out in bigger batches.
+    """
+
+    def __init__(self, embedder: Embeddings, window_seconds: float = 0.01, max_batch_size: int = 1000,
+                 max_in_flight: int = 4, name: str = "embedding_batcher"):
+        self.embedder = embedder
+        self.window_seconds = window_seconds
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_in_flight = max(1, max_in_flight)
+        self.name = name
+        # (request, start) slices of texts still to send, oldest first
+        self._queue: deque = deque()
+        self._queued_texts = 0
+        self._cond = threading.Condition()
+        self._in_flight = threading.Semaphore(self.max_in_flight)
+        self._executor = ThreadPoolExecutor(max_workers=self.max_in_flight, thread_name_prefix=name)
+        self._dispatcher = None
+
+    def embed(self, texts: list[str]) -> list[list[float]]:
+        if not texts:
+            return []
+        request = _Request(list(texts))
+        with self._cond:
+            if self._dispatcher is None:
+                self._dispatcher = threading.Thread(target=self._dispatch_forever, name=f"{self.name}-dispatcher", daemon=True)
+                self._dispatcher.start()
+            self._queue.append((request, 0))
+            self._queued_texts += len(request.texts)
+            metrics.set_gauge(f"{self.name}.queued_texts", self._queued_texts)
+            self._cond.notify()
+        return request.future.result()
+
+    def _next_batch(self) -> list:
+        """Wait for a full batch or the end of the oldest request's window, then take the batch."""
+        with self._cond:
+            while True:
+                if self._queue:
+                    if self._queued_texts >= self.max_batch_size:
+                        break
+                    wait = self._queue[0][0].queued_at + self.window_seconds - time.monotonic()
+                    if wait <= 0:
+                        break
+                    self._cond.wait(wait)
+                else:
+                    self._cond.wait()
+
+            batch = []
+            size = 0
+            while self._queue and size < self.max_batch_size:
+                request, start = self._queue.popleft()
+                take = min(len(request.texts) - start, self.max_batch_size - size)
+                batch.append((request, start, take))
+                size += take
+                if start + take < len(request.texts):
+                    # Too big for this batch, the rest goes first in the next one
+                    self._queue.appendleft((request, start + take))
+            self._queued_texts -= size
+            metrics.set_gauge(f"{self.name}.queued_texts", self._queued_texts)
+            return batch
+
+    def _dispatch_forever(self):
+        while True:
+            # Take a slot before forming the batch, so texts keep piling up while all calls are busy
+            self._in_flight.acquire()
+            batch = self._next_batch()
+            self._executor.submit(self._send, batch)
+
+    def _send(self, batch: list):
+        try:
+            texts = [text for request, start, take in batch for text in request.texts[start:start + take]]
+            metrics.observe(f"{self.name}.batch_texts", len(texts))
+            metrics.observe(f"{self.name}.batch_requests", len(batch))
+            try:
+                with metrics.timer(f"{self.name}.provider_seconds"):
+                    vectors = self.embedder.embed_documents(texts)
+            except Exception as e:
+                metrics.incr(f"{self.name}.errors")
+                for request, _, _ in batch:
+                    if not request.future.done():
+                        request.future.set_exception(e)
+                return
+            metrics.incr(f"{self.name}.batches")
+
+            offset = 0
+            for request, start, take in batch:
+                # Parts of one big request may come back on different worker threads
+                with self._cond:
+                    request.vectors[start:start + take] = vectors[offset:offset + take]
+                    request.remaining -= take
+                    done = request.remaining == 0
+                offset += take
+                if done and not request.future.done():
+                    metrics.observe(f"{self.name}.request_seconds", time.monotonic() - request.queued_at)
+                    request.future.set_result(request.vectors)
+        finally:
+            self._in_flight.release()
+
+
+class BatchingEmbeddings(Embeddings):
+    """Embeddings whose provider calls go through an EmbeddingBatcher shared by all callers."""
+
+    def __init__(self, embedder: Embeddings, window_seconds: float = 0.01, max_batch_size: int = 1000,
+                 max_in_flight: int = 4, name: str = "embedding_batcher"):
+        self.embedder = embedder
+        # Keeps the cache key of wrapped providers (CachedEmbeddings reads `model`)
+        self.model = getattr(embedder, "model", None) or type(embedder).__name__
+        self.batcher = EmbeddingBatcher(embedder, window_seconds, max_batch_size, max_in_flight, name)
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return self.batcher.embed(texts)
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.batcher.embed([text])[0]
@@ -0,0 +1,159 @@
+# embedding_cache.py  – content-hash cache in front of the embedding provider
+import hashlib
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+import metrics
+
+class EmbeddingCacheStore:
+    """
+    Persistent (model, sha256(text)) -> vector store.
+
+    Vectors are kept on disk as raw float32 blobs in a small SQLite file and the most
+    recently used ones are mirrored in an in-memory LRU of `memory_items` entries.
+    The file holds at most about `max_rows` vectors: once it grows past that, the oldest
+    written ones are pruned (SQLite reuses their pages, so the file stops growing).
+    """
+
+    def __init__(self, cache_dir: str, memory_items: int = 20000, max_rows: int = 50000):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.memory_items = max(0, memory_items)
+        self.max_rows = max(1, max_rows)
+        self._memory: OrderedDict[tuple[str, str], np.ndarray] = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(os.path.join(cache_dir, "embeddings.sqlite3"), check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "model TEXT NOT NULL, text_hash TEXT NOT NULL, vector BLOB NOT NULL, "
+            "PRIMARY KEY (model, text_hash))"
+        )
+        self._conn.commit()
+        # Upper bound on the rows in the table (replaced rows are counted twice until the next prune)
+        self._row_count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        self._prune_locked()
+
+    def _prune_locked(self):
+        if self._row_count <= self.max_rows:
+            return
+        # Down to 90% of the limit, so the next prune is a while away
+        excess = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0] - int(self.max_rows * 0.9)
+        if excess > 0:
+            self._conn.execute("DELETE FROM embeddings WHERE rowid IN (SELECT rowid FROM embeddings ORDER BY rowid LIMIT ?)", (excess,))
+            self._conn.commit()
+            metrics.incr("embedding_cache.rows_pruned", excess)
+        self._row_count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        metrics.set_gauge("embedding_cache.disk_rows", self._row_count)
+
+    def _remember_locked(self, key, vector):
+        if self.memory_items == 0:
+            return
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
+
+    def get_many(self, model: str, text_hashes: list[str]) -> dict[str, np.ndarray]:
+        """Return the cached vectors for whichever of `text_hashes` are known."""
+        found = {}
+        with self._lock:
+            missing = []
+            for text_hash in text_hashes:
+                vector = self._memory.get((model, text_hash))
+                if vector is None:
+                    missing.append(text_hash)
+                else:
+                    self._memory.move_to_end((model, text_hash))
+                    found[text_hash] = vector
+            memory_hits = len(found)
+
+            # SQLite caps bound parameters, so look the rest up in slices
+            for start in range(0, len(missing), 500):
+                chunk = missing[start:start + 500]
+                rows = self._conn.execute(
+                    f"SELECT text_hash, vector FROM embeddings WHERE model = ? AND text_hash IN ({','.join('?' * len(chunk))})",
+                    [model, *chunk],
+                ).fetchall()
+                for text_hash, blob in rows:
+                    vector = np.frombuffer(blob, dtype=np.float32)
+                    found[text_hash] = vector
+                    self._remember_locked((model, text_hash), vector)
+
+        metrics.incr("embedding_cache.memory_hits", memory_hits)
+        metrics.incr("embedding_cache.disk_hits", len(found) - memory_hits)
+        return found
+
+    def put_many(self, model: str, vectors: dict[str, np.ndarray], persist: bool = True):
+        """Cache freshly computed vectors keyed by text hash; in memory only unless `persist`."""
+        with self._lock:
+            if persist:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO embeddings (model, text_hash, vector) VALUES (?, ?, ?)",
+                    [(model, text_hash, vector.astype(np.float32).tobytes()) for text_hash, vector in vectors.items()],
+                )
+                self._conn.commit()
+                self._row_count += len(vectors)
+                self._prune_locked()
+            for text_hash, vector in vectors.items():
+                self._remember_locked((model, text_hash), vector)
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Embeddings wrapper that only sends cache misses to the wrapped provider.
+
+    Duplicate texts within a call are embedded once and misses are sent in batches
+    of at most `batch_size` texts.
+    """
+
+    def __init__(self, embedder: Embeddings, store: EmbeddingCacheStore, batch_size: int = 512, model_name: str = None):
+        self.embedder = embedder
+        self.store = store
+        self.batch_size = max(1, batch_size)
+        self.model_name = model_name or getattr(embedder, "model", None) or type(embedder).__name__
+
+    @staticmethod
+    def hash_text(text: str) -> str:
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        hashes = [self.hash_text(text) for text in texts]
+        found = self.store.get_many(self.model_name, list(dict.fromkeys(hashes)))
+
+        # Unique texts that still need the provider, in first-seen order
+        pending = {}
+        for text, text_hash in zip(texts, hashes):
+            if text_hash not in found and text_hash not in pending:
+                pending[text_hash] = text
+
+        if pending:
+            metrics.incr("embedding_cache.misses", len(pending))
+            pending_items = list(pending.items())
+            for start in range(0, len(pending_items), self.batch_size):
+                batch = pending_items[start:start + self.batch_size]
+                with metrics.timer("embedding_cache.provider_batch_seconds"):
+                    batch_vectors = self.embedder.embed_documents([text for _, text in batch])
+                metrics.incr("embedding_cache.provider_batches")
+                computed = {
+                    text_hash: np.asarray(vector, dtype=np.float32)
+                    for (text_hash, _), vector in zip(batch, batch_vectors)
+                }
+                self.store.put_many(self.model_name, computed)
+                found.update(computed)
+
+        return [found[text_hash].tolist() for text_hash in hashes]
+
+    def embed_query(self, text: str) -> list[float]:
+        # Queries are rarely repeated for long: they only go in the in-memory LRU, never on disk
+        text_hash = self.hash_text(text)
+        found = self.store.get_many(self.model_name, [text_hash])
+        if text_hash not in found:
+            metrics.incr("embedding_cache.query_misses")
+            vector = np.asarray(self.embedder.embed_documents([text])[0], dtype=np.float32)
+            self.store.put_many(self.model_name, {text_hash: vector}, persist=False)
+            found[text_hash] = vector
+        return found[text_hash].tolist()
@@ -0,0 +1,210 @@
+# incremental_backup.py  – content-addressed, segment level backups of per-user store folders
+import hashlib
+import json
+import os
+import shutil
+from datetime import datetime
+from pathlib import Path
+
+import metrics
+from utils import upload_file_bytes, download_file_bytes, delete_file, list_file_names
+
+MANIFEST_VERSION = 1
+# Older manifests (without "segment_prefix") share segments of every user straight under this prefix
+SEGMENT_BLOB_PREFIX = "segments/"
+MANIFEST_SUFFIX = "_manifest.json"
+
+def manifest_blob_name(user_id: str) -> str:
+    return f"{user_id}{MANIFEST_SUFFIX}"
+
+def user_segment_prefix(user_id: str) -> str:
+    """Each user's segments live under their own prefix, so they can be deleted once unreferenced."""
+    return f"{SEGMENT_BLOB_PREFIX}{user_id}/"
+
+def segment_blob_name(segment_hash: str, prefix: str = SEGMENT_BLOB_PREFIX) -> str:
+    return f"{prefix}{segment_hash}"
+
+def manifest_segment_prefix(manifest: dict) -> str:
+    return manifest.get("segment_prefix", SEGMENT_BLOB_PREFIX)
+
+def _iter_segments(file_path: Path, segment_size: int):
+    with open(file_path, "rb") as f:
+        while True:
+            segment = f.read(segment_size)
+            if not segment:
+                break
+            yield segment
+
+def manifest_segment_hashes(manifest: dict) -> set:
+    if not manifest:
+        return set()
+    return {segment for details in manifest.get("files", {}).values() for segment in details.get("segments", [])}
+
+def load_manifest(manifest_path: Path):
+    if not manifest_path.exists():
+        return None
+    try:
+        return json.loads(manifest_path.read_text())
+    except (OSError, ValueError) as e:
+        print(f"Ignoring unreadable manifest {manifest_path}: {e}")
+        return None
+
+def download_manifest(user_id: str):
+    manifest_bytes = download_file_bytes(manifest_blob_name(user_id))
+    if not manifest_bytes:
+        return None
+    return json.loads(manifest_bytes)
+
+def upload_incremental_backup(user_id: str, folder: Path, local_manifest_path: Path, segment_size: int, fmt: str = "chroma") -> dict:
+    """
+    Upload only the segments of `folder` that are not already in blob storage, then the manifest.
+    `fmt` names what the folder holds ("chroma" or "snapshot") and is recorded in the manifest.
+    Segments of the previous manifest that the new one no longer uses are deleted afterwards.
+
+    The manifest of the last successful upload is kept at `local_manifest_path`; when it is
+    missing (e.g. a fresh node) the remote manifest is used to know which segments exist.
+    The caller holds the user's upload lock, so no restore reads the segments being deleted.
+
+    Returns:
+        dict: Segment and byte counts for this upload.
+    """
+    previous = load_manifest(local_manifest_path)
+    if previous is None:
+        try:
+            previous = download_manifest(user_id)
+        except Exception as e:
+            print(f"Could not fetch previous manifest for {user_id}, uploading all segments: {e}")
+            previous = None
+    prefix = user_segment_prefix(user_id)
+    if previous is not None and manifest_segment_prefix(previous) != prefix:
+        # Backed up before segments were kept per user: those stay for the legacy sweep, upload everything
+        previous = None
+    known_segments = manifest_segment_hashes(previous)
+
+    files = {}
+    uploaded_segments = 0
+    uploaded_bytes = 0
+    skipped_segments = 0
+    # Hash and upload in one pass so the manifest always describes exactly the bytes that were read
+    for file_path in sorted(p for p in folder.rglob("*") if p.is_file()):
+        segments = []
+        size = 0
+        for segment in _iter_segments(file_path, segment_size):
+            segment_hash = hashlib.sha256(segment).hexdigest()
+            segments.append(segment_hash)
+            size += len(segment)
+            if segment_hash in known_segments:
+                skipped_segments += 1
+                continue
+            upload_file_bytes(segment_blob_name(segment_hash, prefix), segment)
+            known_segments.add(segment_hash)
+            uploaded_segments += 1
+            uploaded_bytes += len(segment)
+        files[file_path.relative_to(folder).as_posix()] = {"size": size, "segments": segments}
+
+    manifest = {
+        "version": MANIFEST_VERSION,
+        "uid": user_id,
+        "segment_size": segment_size,
+        "format": fmt,
+        "segment_prefix": prefix,
+        "created_at": datetime.now().isoformat(),
+        "files": files,
+    }
+    manifest_bytes = json.dumps(manifest).encode("utf-8")
+    upload_file_bytes(manifest_blob_name(user_id), manifest_bytes, content_type="application/json")
+    local_manifest_path.write_bytes(manifest_bytes)
+
+    # Only after the new manifest is in place: the replaced segments are now unreferenced
+    deleted_segments = 0
+    for segment_hash in manifest_segment_hashes(previous) - manifest_segment_hashes(manifest):
+        try:
+            delete_file(segment_blob_name(segment_hash, prefix))
+            deleted_segments += 1
+        except Exception as e:
+            print(f"Could not delete unused segment {segment_hash} of {user_id}: {e}")
+
+    metrics.incr("backup.segments_deleted", deleted_segments)
+    metrics.incr("backup.segments_uploaded", uploaded_segments)
+    metrics.incr("backup.segments_skipped", skipped_segments)
+    metrics.incr("backup.segment_bytes_uploaded", uploaded_bytes)
+    metrics.incr("backup.bytes_uploaded", uploaded_bytes + len(manifest_bytes))
+    return {
+        "uploaded_segments": uploaded_segments,
+        "skipped_segments": skipped_segments,
+        "deleted_segments": deleted_segments,
+        "uploaded_bytes": uploaded_bytes,
+        "manifest_bytes": len(manifest_bytes),
+    }
+
+def restore_incremental_backup(user_id: str, dest: Path, local_manifest_path: Path, manifest: dict = None):
+    """
+    Rebuild `dest` from the user's remote manifest (or `manifest`, if already downloaded) and its segment blobs.
+
+    Files are assembled in a temporary sibling folder and moved into place at the end,
+    so a failed restore never leaves a half written store behind.
+
+    Returns:
+        str | None: "done" on success, None if the user has no incremental backup.
+    """
+    if manifest is None:
+        manifest = download_manifest(user_id)
+    if manifest is None:
+        return None
+
+    prefix = manifest_segment_prefix(manifest)
+    staging = dest.parent / f"{dest.name}.restoring"
+    if staging.exists():
+        shutil.rmtree(staging)
+    staging.mkdir(parents=True)
+
+    try:
+        for relative_path, details in manifest.get("files", {}).items():
+            target = staging / relative_path
+            target.parent.mkdir(parents=True, exist_ok=True)
+            with open(target, "wb") as f:
+                for segment_hash in details["segments"]:
+                    segment = download_file_bytes(segment_blob_name(segment_hash, prefix))
+                    if segment is None or hashlib.sha256(segment).hexdigest() != segment_hash:
+                        raise RuntimeError(f"Segment {segment_hash} of {relative_path} is missing or corrupt")
+                    f.write(segment)
+            if os.path.getsize(target) != details["size"]:
+                raise RuntimeError(f"Restored {relative_path} has the wrong size")
+
+        if dest.exists():
+            shutil.rmtree(dest)
+        staging.rename(dest)
+    except Exception:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+
+    local_manifest_path.write_text(json.dumps(manifest))
+    return "done"
+
+def sweep_legacy_segments(dry_run: bool = False) -> dict:
+    """
+    Mark and sweep the shared legacy segment namespace: delete every segment directly under
+    SEGMENT_BLOB_PREFIX that no manifest still using it references. New backups never write
+    there, so the sweep cannot race an upload.
+
+    Returns:
+        dict: Number of legacy manifests, legacy segments and segments deleted (or to delete).
+    """
+    names = list_file_names()
+    referenced = set()
+    legacy_manifests = 0
+    for name in names:
+        if "/" in name or not name.endswith(MANIFEST_SUFFIX):
+            continue
+        manifest = download_manifest(name[:-len(MANIFEST_SUFFIX)])
+        if manifest is not None and manifest_segment_prefix(manifest) == SEGMENT_BLOB_PREFIX:
+            legacy_manifests += 1
+            referenced |= manifest_segment_hashes(manifest)
+
+    legacy_segments = [name for name in names if name.startswith(SEGMENT_BLOB_PREFIX) and "/" not in name[len(SEGMENT_BLOB_PREFIX):]]
+    unreferenced = [name for name in legacy_segments if name[len(SEGMENT_BLOB_PREFIX):] not in referenced]
+    if not dry_run:
+        for name in unreferenced:
+            delete_file(name)
+        metrics.incr("backup.legacy_segments_deleted", len(unreferenced))
+    return {"legacy_manifests": legacy_manifests, "legacy_segments": len(legacy_segments), "unreferenced_segments": len(unreferenced)}
@@ -0,0 +1,132 @@
+# llm_runner.py  – runs LLM chains with native async calls, timeouts and per-flow concurrency caps
+import asyncio
+import time
+
+import metrics
+from config import LLM_TIMEOUT_SECONDS, LLM_MAX_CONCURRENCY, LLM_FLOW_CONCURRENCY
+
+# Shown to the user when a call times out (asyncio.TimeoutError from LLM_RUNNER)
+LLM_TIMEOUT_MESSAGE = "Alonis is taking too long to respond, please try again"
+
+# Flows that fan out (one call per recommendation) get a lower cap unless LLM_FLOW_CONCURRENCY says otherwise
+DEFAULT_FLOW_CONCURRENCY = {"recommendation_context": 8}
+
+def parse_flow_limits(spec: str) -> dict:
+    """Parse "flow=limit,flow=limit" (e.g. "talk=64,recommendation_context=4") into a dict."""
+    limits = {}
+    for part in spec.split(","):
+        if not part.strip():
+            continue
+        flow, _, limit = part.partition("=")
+        limits[flow.strip()] = int(limit)
+    return limits
+
+
+class LLMRunner:
+    """
+    Runs chains through their native async API (`ainvoke` / `astream`), so a slow completion
+    only holds its own request and never the event loop.
+
+    Each flow ("talk", "quote", ...) may have at most its own limit of calls running at once
+    (`default_limit` unless listed in `flow_limits`); further calls queue. A call that is not
+    done within `timeout` seconds, queueing included, raises asyncio.TimeoutError. Streams
+    time out when no chunk arrives for `timeout` seconds instead.
+    """
+
+    def __init__(self, default_limit: int = 32, flow_limits: dict = None, timeout: float = 60.0, name: str = "llm"):
+        self.default_limit = max(1, default_limit)
+        self.flow_limits = flow_limits or {}
+        self.timeout = timeout
+        self.name = name
+        self._semaphores: dict[str, asyncio.Semaphore] = {}
+        self._in_flight: dict[str, int] = {}
+        self._waiting: dict[str, int] = {}
+
+    def limit(self, flow: str) -> int:
+        return max(1, self.flow_limits.get(flow, self.default_limit))
+
+    def _semaphore(self, flow: str) -> asyncio.Semaphore:
+        semaphore = self._semaphores.get(flow)
+        if semaphore is None:
+            semaphore = self._semaphores[flow] = asyncio.Semaphore(self.limit(flow))
+        return semaphore
+
+    def _count(self, counts: dict, flow: str, delta: int, gauge: str):
+        counts[flow] = counts.get(flow, 0) + delta
+        metrics.set_gauge(f"{self.name}.{flow}.{gauge}", counts[flow])
+
+    async def _acquire(self, flow: str):
+        started = time.monotonic()
+        self._count(self._waiting, flow, 1, "waiting")
+        try:
+            await self._semaphore(flow).acquire()
+        finally:
+            self._count(self._waiting, flow, -1, "waiting")
+        metrics.observe(f"{self.name}.{flow}.wait_seconds", time.monotonic() - started)
+        self._count(self._in_flight, flow, 1, "in_flight")
+
+    def _release(self, flow: str):
+        self._count(self._in_flight, flow, -1, "in_flight")
+        self._semaphore(flow).release()
+
+    async def _run(self, flow: str, runnable, inputs):
+        await self._acquire(flow)
+        try:
+            with metrics.timer(f"{self.name}.{flow}.call_seconds"):
+                return await runnable.ainvoke(inputs)
+        finally:
+            self._release(flow)
+
+    async def ainvoke(self, flow: str, runnable, inputs, timeout: float = None):
+        """Run `runnable.ainvoke(inputs)` under the flow's cap and timeout."""
+        try:
+            return await asyncio.wait_for(self._run(flow, runnable, inputs), timeout or self.timeout)
+        except asyncio.TimeoutError:
+            metrics.incr(f"{self.name}.{flow}.timeouts")
+            raise
+        except Exception:
+            metrics.incr(f"{self.name}.{flow}.errors")
+            raise
+
+    async def astream(self, flow: str, runnable, inputs, timeout: float = None):
+        """Yield the chunks of `runnable.astream(inputs)`, holding one of the flow's slots until the stream ends."""
+        timeout = timeout or self.timeout
+        try:
+            await asyncio.wait_for(self._acquire(flow), timeout)
+        except asyncio.TimeoutError:
+            metrics.incr(f"{self.name}.{flow}.timeouts")
+            raise
+        chunks = runnable.astream(inputs).__aiter__()
+        try:
+            while True:
+                try:
+                    chunk = await asyncio.wait_for(chunks.__anext__(), timeout)
+                except StopAsyncIteration:
+                    break
+                yield chunk
+        except asyncio.TimeoutError:
+            metrics.incr(f"{self.name}.{flow}.timeouts")
+            raise
+        except Exception:
+            metrics.incr(f"{self.name}.{flow}.errors")
+            raise
+        finally:
+            self._release(flow)
+            # Stops the underlying call too when the caller gives up early
+            if hasattr(chunks, "aclose"):
+                await chunks.aclose()
+
+    def stats(self) -> dict:
+        """Per-flow limit, running and queued calls."""
+        flows = set(self._semaphores) | set(self.flow_limits)
+        return {
+            flow: {"limit": self.limit(flow), "in_flight": self._in_flight.get(flow, 0), "waiting": self._waiting.get(flow, 0)}
+            for flow in sorted(flows)
+        }
+
+# Every LLM call of the app goes through this runner
+LLM_RUNNER = LLMRunner(
+    default_limit=LLM_MAX_CONCURRENCY,
+    flow_limits={**DEFAULT_FLOW_CONCURRENCY, **parse_flow_limits(LLM_FLOW_CONCURRENCY)},
+    timeout=LLM_TIMEOUT_SECONDS,
+)
@@ -0,0 +1,119 @@
+# local_tier.py  – keeps the local per-user store folders within a disk budget
+import asyncio
+import os
+import time
+from pathlib import Path
+
+import metrics
+
+STAGING_SUFFIXES = (".restoring", ".compacting")
+
+def folder_size(folder: Path) -> int:
+    total = 0
+    for dirpath, _, filenames in os.walk(folder):
+        for filename in filenames:
+            try:
+                total += os.path.getsize(os.path.join(dirpath, filename))
+            except OSError:
+                pass
+    return total
+
+class LocalTierManager:
+    """
+    Tracks when each `root/<uid>` store was last used and evicts the coldest ones once
+    the folders together exceed `budget_bytes`. A `<uid>` folder under one of
+    `companion_roots` (e.g. a derived index) counts toward that user's usage.
+
+    `can_evict(uid)` (async) must confirm the user's latest state is safely in blob storage
+    and `evict_fn(uid)` (async) removes the folder; evicted users are restored on next access.
+    Users touched within `min_idle_seconds` are never evicted. The last use is the folder's
+    mtime, which `touch` refreshes (at most every `touch_interval_seconds`), so every worker
+    sharing the volume sees the same access times.
+    """
+
+    def __init__(self, root: Path, budget_bytes: int, can_evict, evict_fn, min_idle_seconds: float = 600.0, companion_roots: list = None, touch_interval_seconds: float = 60.0):
+        self.root = Path(root)
+        self.companion_roots = [Path(companion) for companion in companion_roots or []]
+        self.budget_bytes = budget_bytes
+        self.can_evict = can_evict
+        self.evict_fn = evict_fn
+        self.min_idle_seconds = min_idle_seconds
+        self.touch_interval_seconds = touch_interval_seconds
+        # uid -> when this process last refreshed the folder's mtime (only to rate-limit touch)
+        self._last_touch: dict[str, float] = {}
+
+    def touch(self, uid: str):
+        """Record that `uid`'s local store was just used."""
+        now = time.time()
+        if now - self._last_touch.get(uid, 0.0) < self.touch_interval_seconds:
+            return
+        try:
+            os.utime(self.root / uid)
+        except OSError:
+            # Not created yet (or just evicted), nothing to keep warm
+            return
+        self._last_touch[uid] = now
+
+    def _user_folders(self) -> list[Path]:
+        if not self.root.exists():
+            return []
+        # Staging folders of in-progress restores and compactions are not user stores
+        return [p for p in self.root.iterdir() if p.is_dir() and not p.name.endswith(STAGING_SUFFIXES)]
+
+    def _last_used(self, folder: Path) -> float:
+        try:
+            return folder.stat().st_mtime
+        except OSError:
+            return 0.0
+
+    def disk_usage(self) -> dict[str, int]:
+        """Return the size in bytes of every local user store folder, with its companion folders."""
+        return {
+            folder.name: folder_size(folder) + sum(folder_size(companion / folder.name) for companion in self.companion_roots)
+            for folder in self._user_folders()
+        }
+
+    async def enforce_budget(self) -> int:
+        """Evict cold, backed up users until the local stores fit the budget; returns evictions."""
+        usage = await asyncio.to_thread(self.disk_usage)
+        total = sum(usage.values())
+        metrics.set_gauge("local_tier.disk_bytes", total)
+        metrics.set_gauge("local_tier.user_stores", len(usage))
+        if total <= self.budget_bytes:
+            return 0
+
+        now = time.time()
+        evicted = 0
+        candidates = sorted(usage.keys(), key=lambda uid: self._last_used(self.root / uid))
+        for uid in candidates:
+            if total <= self.budget_bytes:
+                break
+            if now - self._last_used(self.root / uid) < self.min_idle_seconds:
+                # Sorted coldest first, so everyone after this is warmer still
+                break
+            if not await self.can_evict(uid):
+                metrics.incr("local_tier.eviction_skipped_not_backed_up")
+                continue
+            try:
+                if await self.evict_fn(uid):
+                    total -= usage[uid]
+                    evicted += 1
+                    self._last_touch.pop(uid, None)
+            except Exception as e:
+                print(f"Error evicting local store for user {uid}: {e}")
+
+        metrics.incr("local_tier.evictions", evicted)
+        metrics.set_gauge("local_tier.disk_bytes", total)
+        metrics.set_gauge("local_tier.user_stores", len(usage) - evicted)
+        if total > self.budget_bytes:
+            print(f"Local embedding stores still use {total} bytes after evicting {evicted} users (budget {self.budget_bytes})")
+        return evicted
+
+    async def run_forever(self, interval_seconds: float):
+        """Enforce the budget every `interval_seconds` until cancelled."""
+        while True:
+            try:
+                await self.enforce_budget()
+            except Exception as e:
+                print(f"Error enforcing local embedding disk budget: {e}")
+            await asyncio.sleep(interval_seconds)
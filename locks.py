@@ -1,27 +1,372 @@
-# locks.py  – import this anywhere
+# locks.py  – import this anywhere
 import asyncio
-from collections import defaultdict
+import hashlib
+import os
+import re
+import time
+from collections import OrderedDict, deque
 from contextlib import asynccontextmanager
+from itertools import count
+from pathlib import Path
 
-_user_locks: dict[str, asyncio.Lock] = defaultdict(asyncio.Lock)
+try:
+    import fcntl
+except ImportError:  # not available on Windows
+    fcntl = None
 
-def get_user_lock(uid: str) -> asyncio.Lock:
-    """Return the asyncio.Lock dedicated to one user's Chroma store."""
-    return _user_locks[uid]
+import metrics
+from config import LOCK_BACKEND, LOCK_DIR, VECTOR_STORE_MODE
+
+class AsyncRWLock:
+    """
+    Async reader-writer lock: any number of readers share it, a writer holds it alone.
+
+    Writers are preferred - once a writer is waiting, new readers queue behind it, so a
+    steady stream of retrievals cannot starve a store update. Waiters are served in arrival
+    order, with consecutive readers let in together. Not reentrant.
+    """
+
+    def __init__(self):
+        self._readers = 0
+        self._writer = False
+        self._waiters: deque = deque()
+
+    def _wake(self):
+        while self._waiters:
+            kind, future = self._waiters[0]
+            if future.done():
+                # Gave up (timed out or cancelled) while queued
+                self._waiters.popleft()
+                continue
+            if kind == "write":
+                if self._writer or self._readers:
+                    return
+                self._writer = True
+            else:
+                if self._writer:
+                    return
+                self._readers += 1
+            self._waiters.popleft()
+            future.set_result(True)
+            if kind == "write":
+                return
+
+    def _free_for(self, kind: str) -> bool:
+        if kind == "write":
+            return not self._writer and not self._readers and not self._waiters
+        return not self._writer and not self._waiters
+
+    async def _acquire(self, kind: str, timeout: float):
+        if self._free_for(kind):
+            if kind == "write":
+                self._writer = True
+            else:
+                self._readers += 1
+            return
+        metrics.incr(f"locks.{kind}_contended")
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append((kind, future))
+        try:
+            await asyncio.wait_for(future, timeout=timeout)
+        except BaseException:
+            if future.done() and not future.cancelled():
+                # Granted just as we gave up, hand it straight back
+                self._release(kind)
+            else:
+                future.cancel()
+                # A writer leaving the queue may have been all that held the readers back
+                self._wake()
+            raise
+
+    def _release(self, kind: str):
+        if kind == "write":
+            self._writer = False
+        else:
+            self._readers -= 1
+        self._wake()
+
+    async def acquire_read(self, timeout: float = None):
+        await self._acquire("read", timeout)
+
+    async def acquire_write(self, timeout: float = None):
+        await self._acquire("write", timeout)
+
+    def release_read(self):
+        self._release("read")
+
+    def release_write(self):
+        self._release("write")
+
+
+def _file_name(key: str, suffix: str) -> str:
+    return re.sub(r"[^A-Za-z0-9_.-]", "_", key) + suffix
+
+
+class GenerationFiles:
+    """
+    Per-key change counters kept in small files under `root`, so every worker sharing the
+    volume sees them and they outlive restarts.
+    """
+
+    def __init__(self, root: str):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, key: str) -> Path:
+        return self.root / _file_name(key, ".gen")
+
+    def read(self, key: str) -> int:
+        try:
+            return int(self._path(key).read_text() or 0)
+        except (FileNotFoundError, ValueError):
+            return 0
+
+    def bump(self, key: str) -> int:
+        """Count one more change (caller holds the key's exclusive lock)."""
+        generation = self.read(key) + 1
+        path = self._path(key)
+        staging = path.with_name(f"{path.name}.{os.getpid()}")
+        staging.write_text(str(generation))
+        os.replace(staging, path)
+        return generation
+
+
+class InProcessLockBackend:
+    """
+    Per-key AsyncRWLock objects - only coordinates coroutines of this process.
+
+    A key's lock only lives in the registry while someone holds or waits for it, so the
+    registry stays as small as the number of users currently busy instead of growing forever.
+    Store generations are counted under `generation_dir` if given.
+    """
+
+    def __init__(self, generation_dir: str = None):
+        # key -> [lock, number of holders and waiters]
+        self._locks: dict[str, list] = {}
+        self._generations = GenerationFiles(generation_dir) if generation_dir else None
+
+    def registry_size(self) -> int:
+        return len(self._locks)
+
+    def read_generation(self, key: str) -> int:
+        """Number of times the store behind `key` was changed under its exclusive lock."""
+        return self._generations.read(key) if self._generations else 0
+
+    def bump_generation(self, key: str) -> int:
+        return self._generations.bump(key) if self._generations else 0
+
+    @asynccontextmanager
+    async def hold(self, key: str, timeout: float, shared: bool = False):
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [AsyncRWLock(), 0]
+        entry[1] += 1
+        lock = entry[0]
+        try:
+            # Acquire outside the inner try, a timed out waiter must not release a lock someone else holds
+            await (lock.acquire_read(timeout) if shared else lock.acquire_write(timeout))
+            try:
+                yield
+            finally:
+                if shared:
+                    lock.release_read()
+                else:
+                    lock.release_write()
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0 and self._locks.get(key) is entry:
+                # Nobody holds or waits for it, drop it
+                del self._locks[key]
+            metrics.set_gauge("locks.registry_size", len(self._locks))
+
+
+class FileLockBackend:
+    """
+    Per-key OS file locks (flock) under `lock_dir`, so several worker processes sharing one
+    embeddings volume take turns on a store. Coroutines of the same process first queue on an
+    in-process reader-writer lock; shared holders then take LOCK_SH, exclusive ones LOCK_EX.
+    """
+
+    def __init__(self, lock_dir: str, poll_interval: float = 0.05, max_poll_interval: float = 0.5):
+        if fcntl is None:
+            raise RuntimeError("LOCK_BACKEND=file needs fcntl (POSIX only)")
+        self.lock_dir = Path(lock_dir)
+        self.lock_dir.mkdir(parents=True, exist_ok=True)
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max_poll_interval
+        self._local = InProcessLockBackend()
+        self._generations = GenerationFiles(lock_dir)
+
+    def registry_size(self) -> int:
+        return self._local.registry_size()
+
+    def _path(self, key: str) -> Path:
+        return self.lock_dir / _file_name(key, ".lock")
+
+    def read_generation(self, key: str) -> int:
+        """Number of times the store behind `key` was changed under its exclusive lock, by any process."""
+        return self._generations.read(key)
+
+    def bump_generation(self, key: str) -> int:
+        return self._generations.bump(key)
+
+    @asynccontextmanager
+    async def hold(self, key: str, timeout: float, shared: bool = False):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        async with self._local.hold(key, timeout, shared):
+            fd = os.open(self._path(key), os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                interval = self.poll_interval
+                while True:
+                    try:
+                        fcntl.flock(fd, (fcntl.LOCK_SH if shared else fcntl.LOCK_EX) | fcntl.LOCK_NB)
+                        break
+                    except BlockingIOError:
+                        # Held by another process; poll rather than block the event loop
+                        if loop.time() >= deadline:
+                            raise asyncio.TimeoutError(f"Timed out waiting for file lock {key}")
+                        await asyncio.sleep(min(interval, max(0.0, deadline - loop.time())))
+                        interval = min(interval * 2, self.max_poll_interval)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(fd, fcntl.LOCK_UN)
+            finally:
+                os.close(fd)
+
+
+def _make_backend():
+    if LOCK_BACKEND == "file":
+        if VECTOR_STORE_MODE == "shared":
+            # Shared-mode writers lock their uid, not the one collection they all write to
+            raise RuntimeError("LOCK_BACKEND=file is not supported with VECTOR_STORE_MODE=shared")
+        return FileLockBackend(LOCK_DIR)
+    # Generations are still counted on disk: backups record the one they cover (see ragImplementation)
+    return InProcessLockBackend(generation_dir=LOCK_DIR)
+
+# "process" (default) for a single worker, "file" when several workers share the embeddings volume
+LOCK_BACKEND_IMPL = _make_backend()
+
+# Upper bounds (seconds) of the wait/hold histogram buckets; the guards time out at 360s by default
+LOCK_SECONDS_BUCKETS = (0.001, 0.01, 0.1, 0.5, 1, 5, 30, 120, 360)
+
+_held: dict[int, dict] = {}
+_hold_ids = count()
+
+def _describe_holder(task) -> str:
+    if task is None:
+        return "unknown"
+    coro = task.get_coro()
+    return f"{task.get_name()} ({getattr(coro, '__qualname__', coro)})"
+
+@asynccontextmanager
+async def _guard(key: str, kind: str, timeout: float, shared: bool = False):
+    """Hold `key` through the lock backend, recording wait/hold times per lock `kind` and the holder."""
+    started = time.monotonic()
+    acquired = None
+    try:
+        async with LOCK_BACKEND_IMPL.hold(key, timeout, shared):
+            acquired = time.monotonic()
+            metrics.histogram(f"locks.{kind}.wait_seconds", acquired - started, LOCK_SECONDS_BUCKETS)
+            hold_id = next(_hold_ids)
+            _held[hold_id] = {
+                "key": key,
+                "kind": kind,
+                "holder": _describe_holder(asyncio.current_task()),
+                "acquired_at": time.time(),
+                "waited_seconds": round(acquired - started, 3),
+            }
+            try:
+                yield
+            finally:
+                del _held[hold_id]
+                metrics.histogram(f"locks.{kind}.hold_seconds", time.monotonic() - acquired, LOCK_SECONDS_BUCKETS)
+    except asyncio.TimeoutError:
+        if acquired is None:
+            metrics.incr(f"locks.{kind}.timeouts")
+            metrics.histogram(f"locks.{kind}.wait_seconds", time.monotonic() - started, LOCK_SECONDS_BUCKETS)
+        raise
+
+# Store generation last seen by this process, per key (bounded; a forgotten key counts as changed)
+_seen_generations: OrderedDict[str, int] = OrderedDict()
+MAX_TRACKED_GENERATIONS = 10000
+_store_change_listeners = []
+
+def on_store_changed(fn):
+    """
+    Register `fn(key)`, called (holding the key's lock) when another worker process changed the
+    store since this process last held it, so everything cached about the store can be dropped.
+    """
+    _store_change_listeners.append(fn)
+
+def _remember_generation(key: str, generation: int):
+    _seen_generations[key] = generation
+    _seen_generations.move_to_end(key)
+    while len(_seen_generations) > MAX_TRACKED_GENERATIONS:
+        _seen_generations.popitem(last=False)
+
+def _check_generation(key: str):
+    if LOCK_BACKEND != "file":
+        return
+    generation = LOCK_BACKEND_IMPL.read_generation(key)
+    if _seen_generations.get(key) != generation:
+        metrics.incr("locks.store_changed_elsewhere")
+        for fn in _store_change_listeners:
+            fn(key)
+    _remember_generation(key, generation)
+
+def _bump_generation(key: str):
+    generation = LOCK_BACKEND_IMPL.bump_generation(key)
+    if LOCK_BACKEND == "file":
+        _remember_generation(key, generation)
+
+def _redact_key(key: str) -> str:
+    # Keys are uids: show a stable digest, enough to tell locks of the same store apart
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()[:12]
+
+def held_locks() -> dict:
+    """Currently held store locks (longest held first, keys redacted) and the number of live lock entries."""
+    now = time.time()
+    held = sorted(
+        ({**info, "key": _redact_key(info["key"]), "held_seconds": round(now - info["acquired_at"], 3)} for info in _held.values()),
+        key=lambda info: info["held_seconds"],
+        reverse=True,
+    )
+    return {"held": held, "registry_size": LOCK_BACKEND_IMPL.registry_size()}
+
+class StoreWrite:
+    """Yielded by chroma_guard; set `changed = False` when the store was left as it was."""
+
+    def __init__(self):
+        self.changed = True
 
 @asynccontextmanager
 async def chroma_guard(uid: str, timeout: float = 360.0):
     """
-    Async-context that acquires the per-user lock.
+    Async-context that acquires the per-user lock exclusively (for anything that changes the store).
     If lock isn't free within `timeout` seconds → raises asyncio.TimeoutError.
     """
-    lock = get_user_lock(uid)
-    try:
-        await asyncio.wait_for(lock.acquire(), timeout=timeout)
+    async with _guard(uid, "chroma_write", timeout):
+        _check_generation(uid)
+        write = StoreWrite()
+        try:
+            yield write
+        finally:
+            if write.changed:
+                # Tell other workers their cached handles of this store are stale, and backups that they are behind
+                _bump_generation(uid)
+
+@asynccontextmanager
+async def chroma_read_guard(uid: str, timeout: float = 360.0):
+    """
+    Async-context that acquires the per-user lock shared, for reads of the store.
+    Readers run together but wait for (and behind) writers.
+    If lock isn't free within `timeout` seconds → raises asyncio.TimeoutError.
+    """
+    async with _guard(uid, "chroma_read", timeout, shared=True):
+        _check_generation(uid)
         yield
-    finally:
-        if lock.locked():
-            lock.release()
 
 @asynccontextmanager
 async def zip_file_upload_guard(uid: str, timeout: float = 360.0):
@@ -29,10 +374,5 @@ async def zip_file_upload_guard(uid: str, timeout: float = 360.0):
     Async-context that acquires the per-user lock for zip file uploads.
     If lock isn't free within `timeout` seconds → raises asyncio.TimeoutError.
     """
-    lock = get_user_lock(f"{uid}_zip_upload")
-    try:
-        await asyncio.wait_for(lock.acquire(), timeout=timeout)
+    async with _guard(f"{uid}_zip_upload", "zip_upload", timeout):
         yield
-    finally:
-        if lock.locked():
-            lock.release()
\ No newline at end of file
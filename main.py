@@ -4,12 +4,18 @@ from config import appENV, PORT
 from routes import assessmentRoutes, talkRoutes, userActionsRoutes, commonRoutes  # Import routes
 from starlette.middleware.base import BaseHTTPMiddleware
 import json
+import asyncio
+import ragImplementation as rag
 
 class LogResponseMiddleware(BaseHTTPMiddleware):
     async def dispatch(self, request: Request, call_next):
         # Capture response
         response = await call_next(request)
 
+        # Streamed responses (e.g. the SSE talk session) must reach the client as they are produced
+        if response.headers.get("content-type", "").startswith("text/event-stream"):
+            return response
+
         # Read and decode the response body (works if it's JSON or text)
         response_body = b""
         async for chunk in response.body_iterator:
@@ -72,6 +78,22 @@ app.include_router(talkRoutes.router, prefix=prefix + "/talk", tags=["talk"])
 app.include_router(userActionsRoutes.router, prefix=prefix + "/user", tags=["user-actions"])
 app.include_router(commonRoutes.router, prefix=prefix + "/common", tags=["common"])
 
+@app.on_event("startup")
+async def start_background_state():
+    # In shared vector store mode, pull the shared index from blob storage if this node has none
+    await asyncio.to_thread(rag.restore_shared_store_if_missing)
+    # Keep the local per-user embedding folders within the disk budget
+    rag.start_local_tier_manager()
+    # Roll up old login/talk event chunks of users whose stores keep growing
+    rag.start_compaction_scheduler()
+
+@app.on_event("shutdown")
+async def flush_background_state():
+    # Write out embedding updates still sitting in the write-behind buffer before the process exits,
+    # then back up every store that changed since its last upload
+    await rag.flush_pending_embeddings()
+    await rag.flush_pending_backups()
+
 if __name__ == "__main__":
     import uvicorn
     reload = True  if appENV != "local" else False
@@ -0,0 +1,95 @@
+# metrics.py  – process-wide counters, gauges and timings, import this anywhere
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+
+# Only the most recent samples are kept per timing so memory stays flat
+MAX_SAMPLES_PER_TIMING = 1024
+
+_metrics_lock = threading.Lock()
+_counters: dict[str, float] = defaultdict(int)
+_gauges: dict[str, float] = {}
+_timings: dict[str, deque] = defaultdict(lambda: deque(maxlen=MAX_SAMPLES_PER_TIMING))
+_timing_totals: dict[str, int] = defaultdict(int)
+_histograms: dict[str, dict] = {}
+
+def incr(name: str, value: float = 1):
+    """Increase the counter `name` by `value`."""
+    with _metrics_lock:
+        _counters[name] += value
+
+def set_gauge(name: str, value: float):
+    """Set the gauge `name` to its current `value`."""
+    with _metrics_lock:
+        _gauges[name] = value
+
+def observe(name: str, value: float):
+    """Record one sample (e.g. a latency in seconds) for the timing `name`."""
+    with _metrics_lock:
+        _timings[name].append(value)
+        _timing_totals[name] += 1
+
+def histogram(name: str, value: float, buckets):
+    """
+    Count one sample of `name` into cumulative `buckets` (upper bounds, ascending).
+    Unlike timings, histograms count every sample since start, so rare tails stay visible.
+    """
+    with _metrics_lock:
+        hist = _histograms.get(name)
+        if hist is None:
+            hist = _histograms[name] = {"buckets": tuple(buckets), "counts": [0] * (len(buckets) + 1), "count": 0, "sum": 0.0}
+        for i, bound in enumerate(hist["buckets"]):
+            if value <= bound:
+                hist["counts"][i] += 1
+                break
+        else:
+            hist["counts"][-1] += 1
+        hist["count"] += 1
+        hist["sum"] += value
+
+@contextmanager
+def timer(name: str):
+    """Context manager that records how long the wrapped block took under `name`."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start)
+
+def _summarize(samples):
+    ordered = sorted(samples)
+    count = len(ordered)
+    return {
+        "avg": sum(ordered) / count,
+        "p50": ordered[int(0.50 * (count - 1))],
+        "p95": ordered[int(0.95 * (count - 1))],
+        "max": ordered[-1],
+    }
+
+def _cumulative(hist):
+    buckets = {}
+    running = 0
+    for bound, count in zip(list(hist["buckets"]) + ["inf"], hist["counts"]):
+        running += count
+        buckets[f"le_{bound}"] = running
+    return {"count": hist["count"], "sum": hist["sum"], "buckets": buckets}
+
+def snapshot() -> dict:
+    """Return a JSON serializable view of every metric recorded so far."""
+    with _metrics_lock:
+        counters = dict(_counters)
+        gauges = dict(_gauges)
+        timings = {name: list(samples) for name, samples in _timings.items() if samples}
+        totals = dict(_timing_totals)
+        histograms = {name: {**hist, "counts": list(hist["counts"])} for name, hist in _histograms.items()}
+
+    return {
+        "counters": counters,
+        "gauges": gauges,
+        "timings": {
+            name: {"count": totals.get(name, len(samples)), **_summarize(samples)}
+            for name, samples in timings.items()
+        },
+        "histograms": {name: _cumulative(hist) for name, hist in histograms.items()},
+    }
@@ -0,0 +1,41 @@
+"""
+Import per-user Chroma stores into the shared multi-tenant vector index.
+
+Usage:
+    VECTOR_STORE_MODE=shared python migrate_vector_stores.py [--restore] [uid ...]
+
+Without uids every store folder under EMBEDDINGS_DIR is imported. With --restore, the listed
+uids that have no local folder are first restored from their per-user blob backups.
+"""
+import argparse
+import asyncio
+
+import ragImplementation as rag
+from local_tier import STAGING_SUFFIXES
+
+async def migrate(user_ids, restore_missing=False):
+    if not user_ids:
+        user_ids = sorted(p.name for p in rag.EMBEDDING_DIR_PATH.iterdir() if p.is_dir() and not p.name.endswith(STAGING_SUFFIXES))
+
+    total = 0
+    for user_id in user_ids:
+        if not (rag.EMBEDDING_DIR_PATH / user_id).exists():
+            if not restore_missing or await asyncio.to_thread(rag.download_and_restore_user_embeddings, user_id) is None:
+                print(f"Skipping {user_id}: no local store")
+                continue
+        imported = await asyncio.to_thread(rag.import_user_store_into_shared, user_id)
+        total += imported
+        print(f"Imported {imported} chunks for user {user_id}")
+        # Users are backed up one by one in shared mode too
+        rag.BACKUP_SCHEDULER.mark_dirty(user_id)
+
+    # Back up the imported users right away instead of waiting for the scheduler
+    await rag.flush_pending_backups()
+    print(f"Imported {total} chunks from {len(user_ids)} users into {rag.SHARED_STORE_DIR}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import per-user Chroma stores into the shared vector index.")
+    parser.add_argument("user_ids", nargs="*", help="User ids to import (default: every local store)")
+    parser.add_argument("--restore", action="store_true", help="Restore missing users from blob storage first")
+    args = parser.parse_args()
+    asyncio.run(migrate(args.user_ids, restore_missing=args.restore))
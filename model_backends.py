@@ -0,0 +1,147 @@
+# model_backends.py  – embedding and chat model backends selected by config (OpenAI, or offline fakes for load tests)
+import asyncio
+import hashlib
+import json
+import math
+import re
+import time
+from itertools import count
+from typing import Any, Optional
+
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+from config import (OPENAI_API_KEY, EMBEDDING_BACKEND, HASHING_EMBEDDING_DIM, LLM_BACKEND,
+                    SCRIPTED_LLM_LATENCY_SECONDS, SCRIPTED_LLM_TOKEN_SECONDS, SCRIPTED_LLM_OUTPUT_TOKENS,
+                    SCRIPTED_LLM_RESPONSES_FILE)
+
+class HashingEmbeddings(Embeddings):
+    """
+    Deterministic, offline embedder: each word is hashed into one of `dim` signed buckets and
+    the result is L2 normalised. Texts sharing words get similar vectors, so retrieval still
+    ranks sensibly in benchmarks, and the same text always gets the same vector.
+    """
+
+    def __init__(self, dim: int = 1536):
+        self.dim = dim
+        self.model = f"hashing-{dim}"
+
+    def _embed(self, text: str) -> list[float]:
+        vector = [0.0] * self.dim
+        for word in re.findall(r"\w+", text.lower()):
+            digest = hashlib.blake2b(word.encode("utf-8"), digest_size=8).digest()
+            bucket = int.from_bytes(digest[:4], "little") % self.dim
+            vector[bucket] += 1.0 if digest[4] & 1 else -1.0
+        norm = math.sqrt(sum(value * value for value in vector))
+        if norm == 0:
+            return vector
+        return [value / norm for value in vector]
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> list[float]:
+        return self._embed(text)
+
+
+def _load_scripted_responses(path: str):
+    with open(path) as f:
+        return json.load(f)
+
+_script_turns = count()
+
+
+class ScriptedChatModel(BaseChatModel):
+    """
+    Offline chat model for load tests. Replies with a scripted response - the next one of a
+    list, or the first entry of a {substring: response} dict whose key appears in the prompt -
+    or else echoes the last message, padded to `output_tokens` words. Replies take
+    `latency_seconds` before the first token plus `token_seconds` per token.
+    """
+
+    responses: Any = None
+    latency_seconds: float = 0.0
+    token_seconds: float = 0.0
+    output_tokens: int = 0
+
+    @property
+    def _llm_type(self) -> str:
+        return "scripted"
+
+    def _reply(self, messages: list[BaseMessage]) -> str:
+        prompt = "\n".join(str(message.content) for message in messages)
+        reply = None
+        if isinstance(self.responses, list) and self.responses:
+            # The turn counter is process-wide: one script cycles across every model instance (FLOW_LLM and per-request ones)
+            reply = self.responses[next(_script_turns) % len(self.responses)]
+        elif isinstance(self.responses, dict):
+            reply = next((response for key, response in self.responses.items() if key in prompt), self.responses.get("default"))
+        if reply is not None:
+            return reply
+        words = f"Echo: {messages[-1].content if messages else ''}".split()
+        if len(words) < self.output_tokens:
+            words += [f"token{i}" for i in range(len(words), self.output_tokens)]
+        return " ".join(words)
+
+    def _tokens(self, reply: str) -> list[str]:
+        words = reply.split(" ")
+        return [word if i == 0 else " " + word for i, word in enumerate(words)]
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        reply = self._reply(messages)
+        time.sleep(self.latency_seconds + self.token_seconds * len(self._tokens(reply)))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=reply))])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        reply = self._reply(messages)
+        await asyncio.sleep(self.latency_seconds + self.token_seconds * len(self._tokens(reply)))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=reply))])
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        reply = self._reply(messages)
+        time.sleep(self.latency_seconds)
+        for token in self._tokens(reply):
+            time.sleep(self.token_seconds)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+            if run_manager:
+                run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        reply = self._reply(messages)
+        await asyncio.sleep(self.latency_seconds)
+        for token in self._tokens(reply):
+            await asyncio.sleep(self.token_seconds)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+            if run_manager:
+                await run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
+
+
+def get_embeddings_provider(**openai_kwargs) -> Embeddings:
+    """Return the raw embeddings provider for EMBEDDING_BACKEND ("openai" or "hashing")."""
+    if EMBEDDING_BACKEND == "hashing":
+        return HashingEmbeddings(dim=HASHING_EMBEDDING_DIM)
+    from langchain_openai import OpenAIEmbeddings
+    return OpenAIEmbeddings(api_key=OPENAI_API_KEY, **openai_kwargs)
+
+_scripted_responses = None
+
+def get_chat_model(model: str = "gpt-4o-mini", temperature: Optional[float] = None) -> BaseChatModel:
+    """Return a chat model for LLM_BACKEND ("openai" or "scripted")."""
+    global _scripted_responses
+    if LLM_BACKEND == "scripted":
+        if _scripted_responses is None and SCRIPTED_LLM_RESPONSES_FILE:
+            _scripted_responses = _load_scripted_responses(SCRIPTED_LLM_RESPONSES_FILE)
+        return ScriptedChatModel(
+            responses=_scripted_responses,
+            latency_seconds=SCRIPTED_LLM_LATENCY_SECONDS,
+            token_seconds=SCRIPTED_LLM_TOKEN_SECONDS,
+            output_tokens=SCRIPTED_LLM_OUTPUT_TOKENS,
+        )
+    from langchain_openai import ChatOpenAI
+    if temperature is None:
+        return ChatOpenAI(api_key=OPENAI_API_KEY, model=model)
+    return ChatOpenAI(api_key=OPENAI_API_KEY, model=model, temperature=temperature)
@@ -121,3 +121,17 @@ DAILY_STORY_MODEL_PROMPT = """
     {context}
     """
 
+
+TALK_SUMMARY_PROMPT = """
+    You keep the running memory of a talk session between a user and ALONIS, a compassionate personalized AI.
+    You are given the current summary of the conversation so far and the messages that came after it.
+    Return an updated summary that folds the new messages into the current one.
+
+    ** IMPORTANT NOTES THAT MUST BE FOLLOWED **
+     - Keep what matters for continuing the conversation: topics discussed, feelings the user expressed, facts they shared, questions still open and anything ALONIS suggested or promised.
+     - Write in the third person ("The user said ...", "ALONIS suggested ...") as plain text, without markdown.
+     - Keep the summary under {max_words} words, dropping the least important details first.
+
+    Current summary:
+    {summary}
+    """
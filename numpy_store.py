@@ -0,0 +1,131 @@
+# numpy_store.py  – portable vector snapshot format, and a brute-force index/retriever over it for small user stores
+import json
+import os
+import shutil
+from pathlib import Path
+from typing import Any, List
+from uuid import uuid4
+
+import numpy as np
+from langchain.docstore.document import Document
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.retrievers import BaseRetriever
+from pydantic import ConfigDict
+
+VECTORS_FILE = "vectors.f32"
+RECORDS_FILE = "records.jsonl"
+HEADER_FILE = "header.json"
+FORMAT_VERSION = 1
+
+class NumpyVectorIndex:
+    """
+    A store's chunk vectors as one contiguous float32 (or float16) matrix, with
+    ids/texts/metadata in a JSON lines side file and a header naming the embedding model.
+
+    The same folder layout is the store snapshot format used for backups: it does not depend
+    on the Chroma version, and float32 snapshots are memory-mapped as they are.
+
+    Ranking uses squared L2 distance (what Chroma uses by default), computed from a
+    single matrix-vector product plus the precomputed row norms.
+    """
+
+    def __init__(self, vectors: np.ndarray, records: list[dict], header: dict):
+        self.vectors = vectors
+        self.records = records
+        self.header = header
+        self.count = header["count"]
+        self._sq_norms = np.einsum("ij,ij->i", vectors, vectors) if self.count else np.zeros(0, dtype=np.float32)
+
+    @staticmethod
+    def write(folder: Path, ids, embeddings, documents, metadatas, signature=None, dtype: str = "float32", model: str = None):
+        """Write an index to `folder`, replacing any previous one in a single rename."""
+        NumpyVectorIndex.write_batches(folder, [(ids, embeddings, documents, metadatas)], signature, dtype, model)
+
+    @staticmethod
+    def write_batches(folder: Path, batches, signature=None, dtype: str = "float32", model: str = None) -> int:
+        """
+        Write an index from an iterable of (ids, embeddings, documents, metadatas) batches,
+        holding one batch in memory at a time. Returns the number of rows written.
+        """
+        folder = Path(folder)
+        # Unique per writer, other worker processes may be building the same index
+        staging = folder.parent / f"{folder.name}.building-{os.getpid()}-{uuid4().hex[:8]}"
+        staging.mkdir(parents=True)
+
+        count = 0
+        dim = 0
+        with open(staging / VECTORS_FILE, "wb") as vectors_file, open(staging / RECORDS_FILE, "w") as records_file:
+            for ids, embeddings, documents, metadatas in batches:
+                if len(ids) == 0:
+                    continue
+                matrix = np.asarray(embeddings, dtype=dtype)
+                dim = int(matrix.shape[1])
+                matrix.tofile(vectors_file)
+                for doc_id, text, metadata in zip(ids, documents, metadatas):
+                    records_file.write(json.dumps({"id": doc_id, "page_content": text, "metadata": metadata or {}}, separators=(",", ":")) + "\n")
+                count += len(ids)
+        (staging / HEADER_FILE).write_text(json.dumps({
+            "format_version": FORMAT_VERSION,
+            "count": count,
+            "dim": dim,
+            "dtype": dtype,
+            "model": model,
+            "signature": signature,
+        }))
+
+        shutil.rmtree(folder, ignore_errors=True)
+        try:
+            os.replace(staging, folder)
+        except OSError:
+            # Another writer swapped its (identical) index in first
+            shutil.rmtree(staging, ignore_errors=True)
+        return count
+
+    @classmethod
+    def load(cls, folder: Path):
+        """Memory-map an index written by `write`; None if there is no (complete) index."""
+        folder = Path(folder)
+        try:
+            header = json.loads((folder / HEADER_FILE).read_text())
+        except (OSError, ValueError):
+            return None
+        dtype = header.get("dtype", "float32")
+        if header["count"] == 0:
+            vectors = np.zeros((0, 0), dtype=np.float32)
+        elif dtype == "float32":
+            vectors = np.memmap(folder / VECTORS_FILE, dtype=np.float32, mode="r", shape=(header["count"], header["dim"]))
+        else:
+            # Half precision snapshots are widened once, float16 matrix products are slow
+            vectors = np.fromfile(folder / VECTORS_FILE, dtype=dtype).reshape(header["count"], header["dim"]).astype(np.float32)
+        with open(folder / RECORDS_FILE) as f:
+            records = [json.loads(line) for line in f]
+        return cls(vectors, records, header)
+
+    def search(self, query_vector, k: int = 4) -> list[tuple[Document, float]]:
+        if self.count == 0:
+            return []
+        query = np.asarray(query_vector, dtype=np.float32)
+        # ||q - x||^2 = ||q||^2 - 2 q.x + ||x||^2, the ||q||^2 term does not change the ranking
+        distances = self._sq_norms - 2.0 * (self.vectors @ query) + float(query @ query)
+        k = min(k, self.count)
+        top = np.argpartition(distances, k - 1)[:k]
+        top = top[np.argsort(distances[top])]
+        results = []
+        for row in top:
+            record = self.records[row]
+            results.append((Document(id=record["id"], page_content=record["page_content"], metadata=record["metadata"]), float(distances[row])))
+        return results
+
+
+class NumpyRetriever(BaseRetriever):
+    """Retriever answering top-k queries from a NumpyVectorIndex."""
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    index: Any
+    embeddings: Any
+    k: int = 4
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        query_vector = self.embeddings.embed_query(query)
+        return [doc for doc, _ in self.index.search(query_vector, self.k)]
@@ -1,9 +1,8 @@
 from langchain.docstore.document import Document
-from langchain_openai import ChatOpenAI
-from langchain_openai import OpenAIEmbeddings
 from langchain.chains import create_retrieval_chain
 from langchain.chains.combine_documents import create_stuff_documents_chain
 from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.runnables import RunnableLambda
 from langchain_mongodb import MongoDBAtlasVectorSearch
 from db import ragEmbeddingsCollection
 from langchain.text_splitter import RecursiveCharacterTextSplitter
@@ -11,26 +10,91 @@ from langchain_chroma import Chroma
 import os
 from uuid import uuid4
 from core.userActions import build_context_for_user
-from config import EMBEDDINGS_DIR, OPENAI_API_KEY
-from utils import upload_file_bytes, download_file_bytes
+from config import EMBEDDINGS_DIR, VECTOR_STORE_MODE, SHARED_STORE_DIR, NUMPY_RETRIEVER_MAX_CHUNKS, NUMPY_INDEX_DIR, RETRIEVAL_CACHE_SIZE, RETRIEVAL_CACHE_TTL_SECONDS, WARMUP_CONCURRENCY, BACKUP_SEGMENT_SIZE, BACKUP_MIN_INTERVAL_SECONDS, BLOB_STREAM_CHUNK_SIZE, LOCAL_STORE_DISK_BUDGET_BYTES, LOCAL_STORE_MIN_IDLE_SECONDS, LOCAL_STORE_SWEEP_SECONDS, STORE_CACHE_SIZE, STORE_CACHE_IDLE_SECONDS, EMBEDDING_CACHE_DIR, EMBEDDING_CACHE_MEMORY_ITEMS, EMBEDDING_CACHE_MAX_ROWS, EMBEDDING_BATCH_SIZE, EMBEDDING_BATCH_WINDOW_SECONDS, EMBEDDING_BATCH_MAX_SIZE, EMBEDDING_MAX_IN_FLIGHT, EMBEDDING_WRITE_BEHIND_SECONDS, EMBEDDING_WRITE_BEHIND_MAX_DOCS, COMPACTION_SWEEP_SECONDS, COMPACTION_MIN_INTERVAL_SECONDS, COMPACTION_MIN_NEW_CHUNKS, COMPACTION_SESSION_IDLE_SECONDS, INGEST_BATCH_CHUNKS, SNAPSHOT_DTYPE, SNAPSHOT_DIR
+from utils import open_blob_reader
 from pathlib import Path
-import shutil
 import zipfile
-from locks import chroma_guard, zip_file_upload_guard
+from locks import chroma_guard, chroma_read_guard, zip_file_upload_guard, on_store_changed, LOCK_BACKEND_IMPL
 import asyncio
 import model_prompts
+from store_cache import StoreCache
+from embedding_cache import EmbeddingCacheStore, CachedEmbeddings
+from embedding_batcher import BatchingEmbeddings
+from model_backends import get_embeddings_provider, get_chat_model
+from write_behind import WriteBehindBuffer
+from incremental_backup import upload_incremental_backup, restore_incremental_backup, download_manifest, manifest_blob_name
+from backup_scheduler import BackupScheduler
+from local_tier import LocalTierManager, folder_size
+from blob_storage import get_blob_container
+from numpy_store import NumpyVectorIndex, NumpyRetriever
+from retrieval_cache import CachedRetriever
+from compaction import plan_compaction, CompactionScheduler
+from single_flight import SingleFlight
+from datetime import datetime
+import json
+import metrics
+import shutil
+import threading
+import hashlib
+import re
+import unicodedata
+from itertools import islice
+import time
+
+# Shared splitter & embedder - every embedder goes through the content-hash cache so unchanged text is never re-embedded,
+# and cache misses of all users are batched together into as few provider calls as possible
+CHUNK_SIZE = 1000
+SPLITTER  = RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=200)
+EMBEDDING_CACHE = EmbeddingCacheStore(EMBEDDING_CACHE_DIR, memory_items=EMBEDDING_CACHE_MEMORY_ITEMS, max_rows=EMBEDDING_CACHE_MAX_ROWS)
 
-# Shared splitter & embedder
-SPLITTER  = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
-EMBEDDING = OpenAIEmbeddings(api_key=OPENAI_API_KEY)
+def _batched(embedder, name: str):
+    return BatchingEmbeddings(
+        embedder,
+        window_seconds=EMBEDDING_BATCH_WINDOW_SECONDS,
+        max_batch_size=EMBEDDING_BATCH_MAX_SIZE,
+        max_in_flight=EMBEDDING_MAX_IN_FLIGHT,
+        name=name
+    )
+
+EMBEDDING = CachedEmbeddings(_batched(get_embeddings_provider(), "embedding_batcher"), EMBEDDING_CACHE, batch_size=EMBEDDING_BATCH_SIZE)
+ATLAS_EMBEDDING = CachedEmbeddings(_batched(get_embeddings_provider(disallowed_special=()), "atlas_embedding_batcher"), EMBEDDING_CACHE, batch_size=EMBEDDING_BATCH_SIZE)
 EMBEDDING_DIR_PATH = Path(EMBEDDINGS_DIR)
 
+# Warm Chroma handles for recently active users so each request does not reopen the persist dir
+STORE_CACHE = StoreCache(max_size=STORE_CACHE_SIZE, idle_seconds=STORE_CACHE_IDLE_SECONDS)
+
 ATLAS_VECTOR_SEARCH_INDEX_NAME = "langchain-index-vectorstores"
 
-def create_docs(context, curr_session_id):
-    docs = []
+# Memory-mapped NumPy indexes of small user stores (derived from Chroma, rebuilt when the store changes)
+NUMPY_INDEX_PATH = Path(NUMPY_INDEX_DIR)
+NUMPY_INDEX_CACHE = StoreCache(max_size=STORE_CACHE_SIZE, idle_seconds=STORE_CACHE_IDLE_SECONDS, name="numpy_index_cache")
+_numpy_index_build_lock = threading.Lock()
+
+# Retrieved documents per (uid, store version, query); a write bumps the user's version
+RETRIEVAL_CACHE = StoreCache(max_size=RETRIEVAL_CACHE_SIZE, idle_seconds=RETRIEVAL_CACHE_TTL_SECONDS, name="retrieval_cache")
+_store_versions: dict[str, int] = {}
+
+# Content hashes of the docs already in each user's store (loaded from chunk metadata on first use)
+SEEN_HASH_CACHE = StoreCache(max_size=STORE_CACHE_SIZE, idle_seconds=STORE_CACHE_IDLE_SECONDS, name="seen_hash_cache")
+
+# Restores/rebuilds of missing user stores, one per uid at a time; concurrent callers share it
+USER_STORE_FLIGHTS = SingleFlight(name="user_store_flight")
+
+# Background warmups of user stores started at login
+_warmups: dict[str, asyncio.Task] = {}
+# uid -> login time, oldest first; logins never followed by a response expire after this long
+_login_times: dict[str, float] = {}
+LOGIN_RESPONSE_WINDOW_SECONDS = 3600.0
+_warmup_semaphore = None
+
+# In shared mode every user lives in this one collection and is told apart by the `uid` metadata
+SHARED_STORE_KEY = "_shared"
+SHARED_COLLECTION_NAME = "user_embeddings"
+
+def iter_docs(context, curr_session_id):
+    """Yield one Document per context entry (the generator behind create_docs)."""
     if len(context) == 0:
-        return docs
+        return
     
     if isinstance(context, str):
         context = { "Text Context" : {"content": context, "metadata": {}} }
@@ -39,132 +103,845 @@ def create_docs(context, curr_session_id):
         #print("Context details:", context_details)
         meta_data = context_details.get("metadata", {})
         meta_data["curr_session_id"] = curr_session_id
-        doc = Document(
+        yield Document(
             page_content=title + "\n" + context_details.get("content", ""),
             metadata=meta_data
         )
-        docs.append(doc)
+
+def create_docs(context, curr_session_id):
+    docs = list(iter_docs(context, curr_session_id))
     print("Created documents:", len(docs))
     return docs
 
-def _get_store(user_id: str):
-    """Return a (persisted) Chroma collection for this user."""
+def _is_shared_mode() -> bool:
+    return VECTOR_STORE_MODE == "shared"
+
+def _store_key(user_id: str) -> str:
+    """Key of the store holding this user's chunks (for the handle cache and backups)."""
+    return SHARED_STORE_KEY if _is_shared_mode() else user_id
+
+def _store_folder(store_key: str) -> Path:
+    if store_key == SHARED_STORE_KEY:
+        return Path(SHARED_STORE_DIR)
+    return EMBEDDING_DIR_PATH / store_key
+
+def _persist_directory(store_key: str) -> str:
+    """Path string the store is opened with (chromadb caches its client system by this exact string)."""
+    if store_key == SHARED_STORE_KEY:
+        return str(_store_folder(store_key))
+    return os.path.join(EMBEDDINGS_DIR, store_key)
+
+def _open_store(store_key: str, persist_directory: str = None):
+    """Open the store's Chroma collection, at `persist_directory` instead of its usual folder if given."""
+    if store_key == SHARED_STORE_KEY:
+        return Chroma(
+            collection_name=SHARED_COLLECTION_NAME,
+            persist_directory=persist_directory or _persist_directory(store_key),
+            embedding_function=EMBEDDING
+        )
     return Chroma(
-        persist_directory=os.path.join(EMBEDDINGS_DIR, user_id),
+        persist_directory=persist_directory or _persist_directory(store_key),
         embedding_function=EMBEDDING
     )
 
-async def upload_embeddings_to_azure(user_id: str):
+def _get_store(user_id: str):
+    """Return the (persisted) Chroma collection holding this user's chunks, reusing the cached handle if warm."""
+    store_key = _store_key(user_id)
+    if store_key == user_id:
+        LOCAL_TIER.touch(user_id)
+    store = STORE_CACHE.get(store_key)
+    if store is None:
+        store = _open_store(store_key)
+        STORE_CACHE.put(store_key, store)
+    return store
+
+def _user_store_exists(user_id: str) -> bool:
+    """True if this user already has chunks in the local vector store."""
+    if _is_shared_mode():
+        return len(_get_store(user_id).get(where={"uid": user_id}, limit=1)["ids"]) > 0
+    return os.path.exists(os.path.join(EMBEDDINGS_DIR, user_id))
+
+def _user_retriever(store, user_id: str):
+    """Retriever over one user's chunks - the same interface in both storage modes."""
+    if _is_shared_mode():
+        return store.as_retriever(search_kwargs={"filter": {"uid": user_id}})
+    return store.as_retriever()
+
+def _small_store_retriever(store, user_id: str):
     """
-    Upload the embeddings for a user to Azure Blob Storage.
-    This is useful for backup and loading the embeddings later.
+    Return a NumPy brute-force retriever for a small per-user store, or None to use Chroma.
+
+    The index is a projection of the Chroma store: it is rebuilt whenever the store's chunk
+    count no longer matches the count it was built from.
     """
-    user_folder = EMBEDDING_DIR_PATH / user_id
-    zip_path = EMBEDDING_DIR_PATH / f"{user_id}_chroma.zip"
+    if _is_shared_mode() or NUMPY_RETRIEVER_MAX_CHUNKS <= 0:
+        return None
+    count = store._collection.count()
+    if count == 0 or count > NUMPY_RETRIEVER_MAX_CHUNKS:
+        return None
+
+    index = NUMPY_INDEX_CACHE.get(user_id)
+    if index is None or index.count != count:
+        index = NumpyVectorIndex.load(NUMPY_INDEX_PATH / user_id)
+    if index is None or index.count != count:
+        # Retrievals share the user's lock, so two of them may get here at once; build once
+        with _numpy_index_build_lock:
+            index = NumpyVectorIndex.load(NUMPY_INDEX_PATH / user_id)
+            if index is None or index.count != count:
+                with metrics.timer("numpy_index.build_seconds"):
+                    data = store.get(include=["embeddings", "documents", "metadatas"])
+                    NumpyVectorIndex.write(NUMPY_INDEX_PATH / user_id, data["ids"], data["embeddings"], data["documents"], data["metadatas"])
+                    index = NumpyVectorIndex.load(NUMPY_INDEX_PATH / user_id)
+                metrics.incr("numpy_index.builds")
+    NUMPY_INDEX_CACHE.put(user_id, index)
+    return NumpyRetriever(index=index, embeddings=EMBEDDING)
+
+def _drop_small_store_index(user_id: str):
+    NUMPY_INDEX_CACHE.invalidate(user_id)
+    shutil.rmtree(NUMPY_INDEX_PATH / user_id, ignore_errors=True)
+
+def _bump_store_version(user_id: str):
+    """Mark the user's store as changed so cached retrievals of the old contents are not reused."""
+    _store_versions[user_id] = _store_versions.get(user_id, 0) + 1
+
+def _split_for_user(docs, user_id: str):
+    """Split docs into chunks tagged with the owning uid."""
+    splits = SPLITTER.split_documents(docs)
+    for split in splits:
+        split.metadata["uid"] = user_id
+    return splits
+
+def _normalize_text(text: str) -> str:
+    text = unicodedata.normalize("NFC", text)
+    text = "\n".join(line.rstrip() for line in text.splitlines())
+    return re.sub(r"\n{3,}", "\n\n", text).strip()
+
+def _content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+# Ingestion pipeline: each stage is a generator, so a rebuild only holds one write batch of chunks at a time
+def _normalize_docs(docs):
+    for doc in docs:
+        text = _normalize_text(doc.page_content)
+        if not text:
+            metrics.incr("ingest.empty_skipped")
+            continue
+        yield Document(page_content=text, metadata=dict(doc.metadata))
+
+def _hash_docs(docs):
+    for doc in docs:
+        yield _content_hash(doc.page_content), doc
+
+def _dedup_docs(hashed_docs, seen: set):
+    for doc_hash, doc in hashed_docs:
+        if doc_hash in seen:
+            metrics.incr("ingest.duplicates_skipped")
+            continue
+        seen.add(doc_hash)
+        doc.metadata["doc_hash"] = doc_hash
+        yield doc
+
+def _split_docs(docs, user_id: str):
+    for doc in docs:
+        doc.metadata["uid"] = user_id
+        if len(doc.page_content) <= CHUNK_SIZE:
+            # The splitter would return it unchanged
+            metrics.incr("ingest.small_docs")
+            yield doc
+        else:
+            metrics.incr("ingest.split_docs")
+            yield from SPLITTER.split_documents([doc])
+
+def _seen_hashes(store, user_id: str) -> set:
+    """Content hashes of the docs already in the user's store."""
+    seen = SEEN_HASH_CACHE.get(user_id)
+    if seen is None:
+        data = _read_user_chunks(store, user_id, ["documents", "metadatas"])
+        # Chunks written before doc hashes were recorded count by their own text (small docs are one chunk)
+        seen = {
+            (metadata or {}).get("doc_hash") or _content_hash(_normalize_text(text or ""))
+            for text, metadata in zip(data["documents"], data["metadatas"])
+        }
+        SEEN_HASH_CACHE.put(user_id, seen)
+    return seen
+
+def _ingest_docs(store, docs, user_id: str, seen: set) -> int:
+    """
+    Normalize, hash, dedup (against `seen`), split and embed `docs` into `store`, writing
+    INGEST_BATCH_CHUNKS chunks at a time. Returns the number of chunks written.
+    """
+    chunks = _split_docs(_dedup_docs(_hash_docs(_normalize_docs(docs)), seen), user_id)
+    written = 0
+    try:
+        while True:
+            batch = list(islice(chunks, INGEST_BATCH_CHUNKS))
+            if not batch:
+                break
+            store.add_documents(documents=batch, ids=[f"{user_id}_{uuid4().hex}" for _ in batch])
+            written += len(batch)
+    except Exception:
+        # `seen` already holds the hashes of docs that did not make it in; reload it next time
+        SEEN_HASH_CACHE.invalidate(user_id)
+        raise
+    metrics.incr("ingest.chunks_written", written)
+    return written
+
+def _local_manifest_path(user_id: str) -> Path:
+    return EMBEDDING_DIR_PATH / f"{user_id}_manifest.json"
+
+def _backed_up_generation_path(user_id: str) -> Path:
+    return EMBEDDING_DIR_PATH / f"{user_id}_backed_up_generation"
+
+def _backed_up_generation(user_id: str):
+    """Store generation the user's uploaded backup was exported at (None if unknown)."""
+    try:
+        return int(_backed_up_generation_path(user_id).read_text())
+    except (FileNotFoundError, ValueError):
+        return None
 
-    if not user_folder.exists():
+def _record_backed_up_generation(user_id: str, generation: int):
+    path = _backed_up_generation_path(user_id)
+    staging = path.with_name(f"{path.name}.{os.getpid()}")
+    staging.write_text(str(generation))
+    os.replace(staging, path)
+
+SNAPSHOT_PATH = Path(SNAPSHOT_DIR)
+SNAPSHOT_BATCH_SIZE = 500
+
+def _embedding_model_name() -> str:
+    return getattr(EMBEDDING, "model_name", None) or type(EMBEDDING).__name__
+
+def _snapshot_batches(store, where: dict = None):
+    offset = 0
+    while True:
+        batch = store.get(where=where, include=["embeddings", "documents", "metadatas"], limit=SNAPSHOT_BATCH_SIZE, offset=offset)
+        if len(batch["ids"]) == 0:
+            return
+        yield batch["ids"], batch["embeddings"], batch["documents"], batch["metadatas"]
+        offset += len(batch["ids"])
+
+def _export_snapshot(user_id: str) -> Path:
+    """
+    Write the user's chunks to a fresh snapshot folder under SNAPSHOT_DIR: one SNAPSHOT_DTYPE
+    vector matrix, ids/texts/metadata as JSON lines and a header naming the embedding model.
+    In shared mode only the user's own chunks of the shared collection are exported.
+    The caller holds the user's store lock and deletes the folder when done with it.
+    """
+    store_key = _store_key(user_id)
+    store = STORE_CACHE.get(store_key) or _open_store(store_key)
+    where = {"uid": user_id} if _is_shared_mode() else None
+    folder = SNAPSHOT_PATH / f"{user_id}-{uuid4().hex[:8]}"
+    with metrics.timer("snapshot.export_seconds"):
+        count = NumpyVectorIndex.write_batches(folder, _snapshot_batches(store, where), dtype=SNAPSHOT_DTYPE, model=_embedding_model_name())
+    metrics.incr("snapshot.chunks_exported", count)
+    return folder
+
+async def upload_embeddings_to_azure(user_id: str):
+    """
+    Back up the embeddings for a user to Azure Blob Storage as a portable snapshot.
+    Only the segments that changed since the last backup are uploaded, followed by the
+    user's manifest, so each upload costs roughly the size of the delta. In shared mode
+    users are backed up one by one too, under the same lock their writers take.
+    """
+    if not _is_shared_mode() and not _store_folder(user_id).exists():
         return "No embeddings created, user folder does not exist."
 
-    # Zip the folder
-    async with zip_file_upload_guard(user_id):
-        print(f"Zipping folder: {user_folder} to {zip_path}")
-        await asyncio.to_thread(shutil.make_archive, str(zip_path).replace(".zip", ""), 'zip', user_folder)
+    async with chroma_read_guard(user_id):
+        if _is_shared_mode() and not await asyncio.to_thread(_user_store_exists, user_id):
+            return "No embeddings created, user has no chunks in the shared store."
+        generation = LOCK_BACKEND_IMPL.read_generation(user_id)
+        snapshot = await asyncio.to_thread(_export_snapshot, user_id)
+    try:
+        async with zip_file_upload_guard(user_id):
+            backed_up = _backed_up_generation(user_id)
+            if backed_up is not None and generation <= backed_up <= LOCK_BACKEND_IMPL.read_generation(user_id):
+                # Another worker already uploaded this state or a newer one, don't overwrite it
+                metrics.incr("backup.stale_uploads_skipped")
+                return "done"
+            stats = await asyncio.to_thread(
+                upload_incremental_backup, user_id, snapshot, _local_manifest_path(user_id), BACKUP_SEGMENT_SIZE, "snapshot"
+            )
+            _record_backed_up_generation(user_id, generation)
+    finally:
+        await asyncio.to_thread(shutil.rmtree, snapshot, True)
+    print(f"Backed up embeddings for user {user_id}: {stats}")
+    return "done"
 
-        # Read and upload
-        file_bytes = zip_path.read_bytes()
-        await asyncio.to_thread(upload_file_bytes, zip_path.name, file_bytes)
+# Debounces backups so a busy user is uploaded at most once per BACKUP_MIN_INTERVAL_SECONDS
+BACKUP_SCHEDULER = BackupScheduler(upload_embeddings_to_azure, min_interval_seconds=BACKUP_MIN_INTERVAL_SECONDS)
 
-        # Clean up the zip file
-        zip_path.unlink()
-        return "done"
+async def flush_pending_backups():
+    """Upload every user whose store changed since its last backup (used on shutdown)."""
+    await BACKUP_SCHEDULER.flush_all()
 
-def download_and_restore_user_embeddings(user_id: str):
+def download_and_restore_legacy_zip(user_id: str):
     """
-    Downloads a zipped Chroma embedding folder for a user,
-    unzips it into the correct location, and deletes the zip.
+    Restores a zipped Chroma embedding folder for a user (the backup format used before
+    incremental manifests). The archive is read straight from blob storage in
+    BLOB_STREAM_CHUNK_SIZE ranges, so it is never buffered whole in memory or on disk.
 
     Args:
         user_id (str): User ID to restore embeddings for.
-        EMBEDDING_DIR_PATH (Path): Root directory where embeddings live.
-        download_file_bytes (function): Function that takes filename and returns file bytes.
     """
     zip_filename = f"{user_id}_chroma.zip"
-    zip_path = EMBEDDING_DIR_PATH / zip_filename
 
-    # Download zip bytes
-    file_bytes = download_file_bytes(zip_filename)
-    if not file_bytes:
+    reader = open_blob_reader(zip_filename, chunk_size=BLOB_STREAM_CHUNK_SIZE)
+    if reader is None:
         print(f"No zip found for user {user_id}")
         return
 
-    # Save zip file temporarily
-    with open(zip_path, "wb") as f:
-        f.write(file_bytes)
-
     # Extract zip contents to EMBEDDING_DIR_PATH / user_id
     extract_path = EMBEDDING_DIR_PATH / user_id
     extract_path.mkdir(parents=True, exist_ok=True)
 
-    with zipfile.ZipFile(zip_path, "r") as zip_ref:
+    with reader, zipfile.ZipFile(reader, "r") as zip_ref:
         zip_ref.extractall(extract_path)
+    return "done"
+
+def _add_snapshot_chunks(store, index, uid: str = None) -> bool:
+    """
+    Add a loaded snapshot's chunks to `store` (tagged with `uid` if given), reusing its vectors
+    when they come from the current embedding model. Returns whether they did.
+    """
+    same_model = index.header.get("model") == _embedding_model_name()
+    for start in range(0, index.count, SNAPSHOT_BATCH_SIZE):
+        records = index.records[start:start + SNAPSHOT_BATCH_SIZE]
+        texts = [record["page_content"] for record in records]
+        if same_model:
+            embeddings = index.vectors[start:start + len(records)].tolist()
+        else:
+            embeddings = EMBEDDING.embed_documents(texts)
+        metadatas = [record["metadata"] or None for record in records]
+        if uid is not None:
+            metadatas = [{**(metadata or {}), "uid": uid} for metadata in metadatas]
+        store._collection.upsert(
+            ids=[record["id"] for record in records],
+            embeddings=embeddings,
+            documents=texts,
+            metadatas=metadatas,
+        )
+    if not same_model:
+        metrics.incr("snapshot.reembedded_restores")
+    return same_model
+
+def _build_store_from_snapshot(store_key: str, snapshot: Path):
+    """
+    Rebuild the store's Chroma folder from a snapshot, reusing its vectors when they come from
+    the current embedding model and re-embedding the texts otherwise. A small per-user snapshot
+    is then kept as the user's NumPy index, so retrieval can start from it straight away.
+    """
+    index = NumpyVectorIndex.load(snapshot)
+    if index is None:
+        raise RuntimeError(f"Snapshot of {store_key} is missing its header")
+    persist_directory = _persist_directory(store_key)
+    staging = f"{persist_directory}.restoring"
+    shutil.rmtree(staging, ignore_errors=True)
+
+    same_model = _add_snapshot_chunks(_open_store(store_key, persist_directory=staging), index)
+    _release_chroma_system(staging)
 
-    # Clean up zip file
-    zip_path.unlink()
+    STORE_CACHE.invalidate(store_key)
+    _release_chroma_system(persist_directory)
+    shutil.rmtree(persist_directory, ignore_errors=True)
+    os.replace(staging, persist_directory)
+
+    if store_key != SHARED_STORE_KEY and same_model and 0 < index.count <= NUMPY_RETRIEVER_MAX_CHUNKS:
+        _drop_small_store_index(store_key)
+        NUMPY_INDEX_PATH.mkdir(parents=True, exist_ok=True)
+        shutil.move(str(snapshot), str(NUMPY_INDEX_PATH / store_key))
+
+def _restore_store_from_backup(store_key: str):
+    """
+    Restore a store from its incremental backup: snapshot backups are rebuilt into a Chroma
+    folder, older backups of the Chroma folder itself are restored as they are.
+
+    Returns:
+        str | None: "done" on success, None if the store has no incremental backup.
+    """
+    manifest = download_manifest(store_key)
+    if manifest is None:
+        return None
+    if manifest.get("format", "chroma") != "snapshot":
+        return restore_incremental_backup(store_key, _store_folder(store_key), _local_manifest_path(store_key), manifest=manifest)
+
+    snapshot = SNAPSHOT_PATH / f"{store_key}-{uuid4().hex[:8]}"
+    try:
+        restore_incremental_backup(store_key, snapshot, _local_manifest_path(store_key), manifest=manifest)
+        with metrics.timer("snapshot.build_seconds"):
+            _build_store_from_snapshot(store_key, snapshot)
+    finally:
+        shutil.rmtree(snapshot, ignore_errors=True)
     return "done"
 
-async def create_embeddings_for_user(docs, user_id: str) -> str:
-    """Create a fresh store (overwrites any existing one)."""
-    splits = SPLITTER.split_documents(docs)
+LEGACY_ZIP_RESTORED = "legacy_zip"
+
+def download_and_restore_user_embeddings(user_id: str):
+    """
+    Restores a user's Chroma embedding folder from blob storage.
+    The incremental backup (snapshot or Chroma folder) is preferred; users only backed up as
+    a whole zip fall back to it.
+
+    Args:
+        user_id (str): User ID to restore embeddings for.
+
+    Returns:
+        str | None: "done" if a backup was restored, LEGACY_ZIP_RESTORED if it came from the old
+                    zip format (the caller should schedule a backup), None if the user has no backup.
+    """
+    with metrics.timer("local_tier.restore_seconds"):
+        res = _restore_store_from_backup(user_id)
+        if res is None and download_and_restore_legacy_zip(user_id) is not None:
+            res = LEGACY_ZIP_RESTORED
+    if res is not None:
+        metrics.incr("local_tier.restores")
+        LOCAL_TIER.touch(user_id)
+    return res
+
+def _restore_user_into_shared(user_id: str):
+    """
+    Shared mode: add a user's snapshot backup to the shared collection.
+    Returns "done", or None if the user has no snapshot backup.
+    """
+    manifest = download_manifest(user_id)
+    if manifest is None or manifest.get("format", "chroma") != "snapshot":
+        # Older backups hold a whole per-user Chroma folder, such users are rebuilt from their data
+        return None
+    snapshot = SNAPSHOT_PATH / f"{user_id}-{uuid4().hex[:8]}"
+    try:
+        with metrics.timer("local_tier.restore_seconds"):
+            restore_incremental_backup(user_id, snapshot, _local_manifest_path(user_id), manifest=manifest)
+            index = NumpyVectorIndex.load(snapshot)
+            if index is None:
+                raise RuntimeError(f"Snapshot of {user_id} is missing its header")
+            _add_snapshot_chunks(_get_store(user_id), index, uid=user_id)
+        SEEN_HASH_CACHE.invalidate(user_id)
+        _bump_store_version(user_id)
+    finally:
+        shutil.rmtree(snapshot, ignore_errors=True)
+    metrics.incr("local_tier.restores")
+    return "done"
+
+def _restore_user_store(user_id: str):
+    """Restore a missing user store from blob storage; None if there is nothing to restore."""
+    if _is_shared_mode():
+        return _restore_user_into_shared(user_id)
+    return download_and_restore_user_embeddings(user_id)
 
-    # Generate truly unique ids per split to avoid future collisions
-    ids = [f"{user_id}_{uuid4().hex}" for _ in splits]
+def restore_shared_store_if_missing():
+    """
+    In shared mode, restore the shared index from a whole-store backup (as written before users
+    were backed up one by one) if this node has no copy yet.
+    """
+    if not _is_shared_mode() or _store_folder(SHARED_STORE_KEY).exists():
+        return None
+    with metrics.timer("local_tier.restore_seconds"):
+        res = _restore_store_from_backup(SHARED_STORE_KEY)
+    print(f"Restored shared vector store from blob storage: {res}")
+    return res
+
+def import_user_store_into_shared(user_id: str, batch_size: int = 500) -> int:
+    """
+    Copy a local per-user Chroma store into the shared collection, reusing its stored
+    vectors (nothing is re-embedded). Only valid in shared mode.
+    Returns the number of chunks imported.
+    """
+    if not _is_shared_mode():
+        raise RuntimeError("Set VECTOR_STORE_MODE=shared to import per-user stores into the shared index")
+    source = Chroma(
+        persist_directory=os.path.join(EMBEDDINGS_DIR, user_id),
+        embedding_function=EMBEDDING
+    )
+    shared = _get_store(user_id)
+    imported = 0
+    offset = 0
+    while True:
+        batch = source.get(include=["embeddings", "documents", "metadatas"], limit=batch_size, offset=offset)
+        if len(batch["ids"]) == 0:
+            break
+        shared._collection.upsert(
+            ids=batch["ids"],
+            embeddings=batch["embeddings"],
+            documents=batch["documents"],
+            metadatas=[{**(metadata or {}), "uid": user_id} for metadata in batch["metadatas"]],
+        )
+        imported += len(batch["ids"])
+        offset += len(batch["ids"])
+    return imported
+
+def _release_chroma_system(persist_directory: str):
+    """
+    Stop chromadb's process-wide cached client system for a persist directory, so a store
+    that is deleted and later restored is reopened from the files on disk.
+    """
+    try:
+        from chromadb.api.shared_system_client import SharedSystemClient
+    except ImportError:
+        from chromadb.api.client import SharedSystemClient
+    system = SharedSystemClient._identifier_to_system.pop(persist_directory, None)
+    if hasattr(SharedSystemClient, "_identifier_to_refcount"):
+        SharedSystemClient._identifier_to_refcount.pop(persist_directory, None)
+    if system is not None:
+        system.stop()
 
+async def _is_local_store_backed_up(user_id: str) -> bool:
+    """True if the user's latest local state is confirmed in blob storage."""
+    if BACKUP_SCHEDULER.is_pending(user_id) or WRITE_BEHIND.pending_count(user_id) > 0:
+        return False
+    # Any worker's write since the last upload moved the generation past the one the backup covers
+    if _backed_up_generation(user_id) != LOCK_BACKEND_IMPL.read_generation(user_id):
+        return False
+    if not _local_manifest_path(user_id).exists():
+        return False
+    try:
+        return await asyncio.to_thread(get_blob_container().exists, manifest_blob_name(user_id))
+    except Exception as e:
+        print(f"Could not confirm backup of user {user_id}: {e}")
+        return False
+
+async def evict_local_store(user_id: str) -> bool:
+    """Delete a user's local store folder if it is backed up; it is restored on next access."""
+    async with chroma_guard(user_id) as write:
+        # Re-check under the lock, a write may have landed since the sweep looked
+        if not await _is_local_store_backed_up(user_id):
+            write.changed = False
+            return False
+        persist_directory = os.path.join(EMBEDDINGS_DIR, user_id)
+        STORE_CACHE.invalidate(user_id)
+        SEEN_HASH_CACHE.invalidate(user_id)
+        _release_chroma_system(persist_directory)
+        await asyncio.to_thread(shutil.rmtree, persist_directory)
+        await asyncio.to_thread(_drop_small_store_index, user_id)
+    print(f"Evicted local embeddings for user {user_id}")
+    return True
+
+LOCAL_TIER = LocalTierManager(
+    EMBEDDING_DIR_PATH,
+    budget_bytes=LOCAL_STORE_DISK_BUDGET_BYTES,
+    can_evict=_is_local_store_backed_up,
+    evict_fn=evict_local_store,
+    min_idle_seconds=LOCAL_STORE_MIN_IDLE_SECONDS,
+    # Small stores' NumPy indexes are a second copy of their vectors, evicted along with them
+    companion_roots=[NUMPY_INDEX_PATH]
+)
+
+def start_local_tier_manager():
+    """Start the background loop that keeps local stores within the disk budget."""
+    return asyncio.create_task(LOCAL_TIER.run_forever(LOCAL_STORE_SWEEP_SECONDS))
+
+async def create_embeddings_for_user(docs, user_id: str) -> str:
+    """Create a fresh store (overwrites any existing one). `docs` may be any iterable, e.g. a generator."""
     # Create the store and add documents. Use async context manager to ensure the lock is acquired and released properly. This way we can ensure that no other process is trying to write to the same user's store at the same time.
     async with chroma_guard(user_id):
-        Chroma.from_documents(
-            documents=splits,
-            ids=ids,
-            persist_directory=os.path.join(EMBEDDINGS_DIR, user_id),
-            embedding=EMBEDDING
-        )
-    print(f"Created embeddings for user {user_id} with {len(splits)} documents. in {os.path.join(EMBEDDINGS_DIR, user_id)}")
+        SEEN_HASH_CACHE.invalidate(user_id)
+        # Embedding runs off the event loop, so other users' chunks can join the same provider batch
+        if _is_shared_mode():
+            written = await asyncio.to_thread(_ingest_docs, _get_store(user_id), docs, user_id, set())
+        else:
+            # Any warm handle points at the store being overwritten, so drop it first
+            STORE_CACHE.invalidate(user_id)
+            store = await asyncio.to_thread(_open_store, user_id)
+            written = await asyncio.to_thread(_ingest_docs, store, docs, user_id, set())
+            STORE_CACHE.put(user_id, store)
+            LOCAL_TIER.touch(user_id)
+        _bump_store_version(user_id)
+    print(f"Created embeddings for user {user_id} with {written} documents. in {_store_folder(_store_key(user_id))}")
 
-    # Upload the embeddings to Azure Blob Storage for backup and loading
-    asyncio.create_task(upload_embeddings_to_azure(user_id))
+    # Schedule a (debounced) backup of the embeddings to Azure Blob Storage
+    BACKUP_SCHEDULER.mark_dirty(user_id)
     return "done"
 
-async def update_embeddings_for_user(docs, user_id: str) -> str:
-    """Append new docs to an existing user store (creates one if absent)."""
-    if not os.path.exists(os.path.join(EMBEDDINGS_DIR, user_id)):
-        print(f"No embeddings found for user {user_id}, creating a new store.")
-        # No store yet → Try loading from azure Blob Storage and if still not there then build context from user data
+def _forget_store_caches(user_id: str):
+    """Another worker process changed this user's store: drop everything this process cached about it."""
+    STORE_CACHE.invalidate(user_id)
+    SEEN_HASH_CACHE.invalidate(user_id)
+    _release_chroma_system(_persist_directory(user_id))
+    _drop_small_store_index(user_id)
+    _bump_store_version(user_id)
+
+on_store_changed(_forget_store_caches)
+
+def _discard_user_store(user_id: str):
+    """Delete a per-user store folder and every cached handle of it (caller holds the user's write lock)."""
+    if _is_shared_mode():
+        return
+    persist_directory = _persist_directory(user_id)
+    STORE_CACHE.invalidate(user_id)
+    SEEN_HASH_CACHE.invalidate(user_id)
+    _release_chroma_system(persist_directory)
+    shutil.rmtree(persist_directory, ignore_errors=True)
+
+async def _restore_or_rebuild_user_store(user_id: str):
+    """Restore a missing user store from blob storage, or rebuild it from the user's data."""
+    if _user_store_exists(user_id):
+        # Created (e.g. by signup) between the caller's check and this flight starting
+        return
+    print(f"No embeddings found for user {user_id}, creating a new store.")
+    # No store yet → Try loading from azure Blob Storage and if still not there then build context from user data
+    async with chroma_guard(user_id):
+        # Attempt to download and restore user embeddings
+        print(f"Attempting to download and restore user embeddings for {user_id}")
         try:
-            async with chroma_guard(user_id):
-                # Attempt to download and restore user embeddings
-                print(f"Attempting to download and restore user embeddings for {user_id}")
-                async with zip_file_upload_guard(user_id):
-                    res = download_and_restore_user_embeddings(user_id)
+            async with zip_file_upload_guard(user_id):
+                res = await asyncio.to_thread(_restore_user_store, user_id)
+                if res == "done":
+                    # The store now is the backup; the guard bumps the generation once on exit
+                    _record_backed_up_generation(user_id, LOCK_BACKEND_IMPL.read_generation(user_id) + 1)
         except Exception as e:
             print(f"Error restoring user embeddings for {user_id}: {e}")
             res = None # If the file doesn't exist, then just create an empty store
-        if res is None:
-            # Create with context that is built from user data
-            user_context = build_context_for_user(user_id)
-            user_context_docs = create_docs(user_context, "")
-            await create_embeddings_for_user(user_context_docs, user_id)
+            # The rebuild must not land on top of whatever a failed restore left behind
+            await asyncio.to_thread(_discard_user_store, user_id)
+    if res == LEGACY_ZIP_RESTORED:
+        # Move the user onto incremental backups so the local copy can be evicted later (on the event loop)
+        BACKUP_SCHEDULER.mark_dirty(user_id)
+    if res is None:
+        # Create with context that is built from user data
+        user_context = await asyncio.to_thread(build_context_for_user, user_id)
+        await create_embeddings_for_user(iter_docs(user_context, ""), user_id)
 
-    async with chroma_guard(user_id):
-        store  = _get_store(user_id)
+async def _ensure_user_store(user_id: str):
+    """
+    Make sure the user's store exists locally. Concurrent callers for a missing store share one
+    restore/rebuild, so the backup is downloaded (or the context embedded) only once.
+    """
+    if not _user_store_exists(user_id):
+        await USER_STORE_FLIGHTS.do(user_id, lambda: _restore_or_rebuild_user_store(user_id))
 
-        splits = SPLITTER.split_documents(docs)
-        ids    = [f"{user_id}_{uuid4().hex}" for _ in splits]  # unique ids
+async def init_user_store(docs, user_id: str) -> str:
+    """
+    Create a new user's store from their signup docs. If a restore/rebuild of the store is
+    already running (a request raced the signup), wait for it and add the docs to its result.
+    """
+    created = False
 
-        store.add_documents(documents=splits, ids=ids)
+    async def _create():
+        nonlocal created
+        created = True
+        return await create_embeddings_for_user(docs, user_id)
 
-    # Upload the embeddings to Azure Blob Storage for backup and loading
-    asyncio.create_task(upload_embeddings_to_azure(user_id))
+    await USER_STORE_FLIGHTS.do(user_id, _create)
+    if not created:
+        await _write_embeddings_for_user(user_id, docs)
     return "done"
 
+async def _warm_user_store(user_id: str):
+    global _warmup_semaphore
+    if _warmup_semaphore is None:
+        # Created lazily so it binds to the running event loop
+        _warmup_semaphore = asyncio.Semaphore(WARMUP_CONCURRENCY)
+    async with _warmup_semaphore:
+        with metrics.timer("warmup.seconds"):
+            await _ensure_user_store(user_id)
+            async with chroma_read_guard(user_id):
+                # Opening the store puts the handle (and a small store's NumPy index) in the in-memory caches
+                store = _get_store(user_id)
+                await asyncio.to_thread(_small_store_retriever, store, user_id)
+
+def start_user_store_warmup(user_id: str):
+    """
+    Start warming a user's store in the background (restore if missing, open, cache) so their
+    first talk/quote request does not pay for it. Returns the in-flight warmup if one is running.
+    """
+    task = _warmups.get(user_id)
+    if task is not None and not task.done():
+        return task
+    now = time.monotonic()
+    # Re-inserted so the dict stays ordered by login time, then expire from the oldest end
+    _login_times.pop(user_id, None)
+    _login_times[user_id] = now
+    while _login_times:
+        uid, login_time = next(iter(_login_times.items()))
+        if now - login_time <= LOGIN_RESPONSE_WINDOW_SECONDS:
+            break
+        del _login_times[uid]
+    task = asyncio.create_task(_warm_user_store(user_id))
+    _warmups[user_id] = task
+    metrics.incr("warmup.started")
+
+    def _finished(done_task):
+        if _warmups.get(user_id) is done_task:
+            _warmups.pop(user_id, None)
+        if not done_task.cancelled() and done_task.exception() is not None:
+            metrics.incr("warmup.errors")
+            print(f"Error warming embeddings for user {user_id}: {done_task.exception()}")
+
+    task.add_done_callback(_finished)
+    return task
+
+def record_first_response_after_login(user_id: str):
+    """Record the time from login to the user's first served talk/quote/story response."""
+    login_time = _login_times.pop(user_id, None)
+    if login_time is not None:
+        metrics.observe("warmup.login_to_first_response_seconds", time.monotonic() - login_time)
+
+async def _write_embeddings_for_user(user_id: str, docs) -> str:
+    """Append new docs to an existing user store (creates one if absent) as one batch."""
+    while True:
+        await _ensure_user_store(user_id)
+        async with chroma_guard(user_id) as write:
+            if not _user_store_exists(user_id):
+                # Evicted (e.g. by another worker) since it was ensured: restore it first, never write a partial store
+                write.changed = False
+                continue
+            store  = _get_store(user_id)
+            seen = await asyncio.to_thread(_seen_hashes, store, user_id)
+            written = await asyncio.to_thread(_ingest_docs, store, docs, user_id, seen)
+            if written:
+                _bump_store_version(user_id)
+            else:
+                write.changed = False
+        break
+    if not written:
+        # Everything was already in the store
+        return "done"
+    COMPACTION_SCHEDULER.note_writes(user_id, written)
+
+    # Schedule a (debounced) backup of the embeddings to Azure Blob Storage
+    BACKUP_SCHEDULER.mark_dirty(user_id)
+    return "done"
+
+# Coalesces the per-event updates of a user into one split+embed+add_documents batch and one backup
+WRITE_BEHIND = WriteBehindBuffer(
+    _write_embeddings_for_user,
+    window_seconds=EMBEDDING_WRITE_BEHIND_SECONDS,
+    max_docs=EMBEDDING_WRITE_BEHIND_MAX_DOCS
+)
+
+async def update_embeddings_for_user(docs, user_id: str) -> str:
+    """Queue new docs for a user's store; they are written on the next write-behind flush."""
+    await WRITE_BEHIND.add(user_id, docs)
+    return "queued"
+
+async def flush_pending_embeddings(user_id: str = None):
+    """Write any buffered docs now - for one user, or for everyone when `user_id` is None."""
+    if user_id is None:
+        await WRITE_BEHIND.flush_all()
+    else:
+        await WRITE_BEHIND.flush(user_id)
+
+def _read_user_chunks(store, user_id: str, include):
+    if _is_shared_mode():
+        return store.get(where={"uid": user_id}, include=include)
+    return store.get(include=include)
+
+def _payload_bytes(documents, metadatas, embeddings) -> int:
+    """Approximate stored size of chunks: text, metadata and float32 vectors."""
+    total = 0
+    for text, metadata, vector in zip(documents, metadatas, embeddings):
+        total += len((text or "").encode("utf-8")) + len(json.dumps(metadata or {})) + 4 * len(vector)
+    return total
+
+def _rewrite_user_store(user_id: str, data, drop_ids, splits):
+    """
+    Write the kept chunks (with their stored vectors) and the new rollup chunks into a fresh
+    Chroma folder, then swap it in for the user's store so the dropped chunks' space is freed.
+    """
+    persist_directory = os.path.join(EMBEDDINGS_DIR, user_id)
+    staging = f"{persist_directory}.compacting"
+    shutil.rmtree(staging, ignore_errors=True)
+
+    dropped = set(drop_ids)
+    keep = [i for i, chunk_id in enumerate(data["ids"]) if chunk_id not in dropped]
+    compacted = Chroma(persist_directory=staging, embedding_function=EMBEDDING)
+    for start in range(0, len(keep), 500):
+        batch = keep[start:start + 500]
+        compacted._collection.add(
+            ids=[data["ids"][i] for i in batch],
+            embeddings=[data["embeddings"][i] for i in batch],
+            documents=[data["documents"][i] for i in batch],
+            metadatas=[data["metadatas"][i] or None for i in batch],
+        )
+    if splits:
+        compacted.add_documents(documents=splits, ids=[f"{user_id}_{uuid4().hex}" for _ in splits])
+    _release_chroma_system(staging)
+
+    STORE_CACHE.invalidate(user_id)
+    _release_chroma_system(persist_directory)
+    shutil.rmtree(persist_directory)
+    os.replace(staging, persist_directory)
+
+async def compact_user_store(user_id: str):
+    """
+    Compact a user's store: drop chunks with duplicate text and merge the login and talk event
+    chunks of closed periods into rollup chunks (see compaction.plan_compaction).
+
+    Returns:
+        dict | None: Stats of the run, or None if the user has no local store.
+    """
+    await flush_pending_embeddings(user_id)
+    if not _user_store_exists(user_id):
+        return None
+
+    started = time.monotonic()
+    async with chroma_guard(user_id) as write:
+        if not _user_store_exists(user_id):
+            # Evicted since the check above, compacting would write an empty store
+            write.changed = False
+            return None
+        store = _get_store(user_id)
+        data = await asyncio.to_thread(_read_user_chunks, store, user_id, ["embeddings", "documents", "metadatas"])
+        plan = plan_compaction(data["ids"], data["documents"], data["metadatas"], datetime.now(), COMPACTION_SESSION_IDLE_SECONDS)
+        splits = _split_for_user(plan["rollups"], user_id)
+        payload_before = _payload_bytes(data["documents"], data["metadatas"], data["embeddings"])
+
+        if _is_shared_mode():
+            # Other users share the folder, so only this user's chunks can be measured
+            bytes_before = payload_before
+            if plan["drop_ids"]:
+                await asyncio.to_thread(store.delete, ids=plan["drop_ids"])
+                if splits:
+                    await asyncio.to_thread(store.add_documents, documents=splits, ids=[f"{user_id}_{uuid4().hex}" for _ in splits])
+            bytes_after = payload_before
+            if plan["drop_ids"]:
+                after = await asyncio.to_thread(_read_user_chunks, store, user_id, ["embeddings", "documents", "metadatas"])
+                bytes_after = _payload_bytes(after["documents"], after["metadatas"], after["embeddings"])
+        else:
+            bytes_before = await asyncio.to_thread(folder_size, _store_folder(user_id))
+            bytes_after = bytes_before
+            if plan["drop_ids"]:
+                # A backup reading the folder while it is swapped would upload a mix of both stores
+                async with zip_file_upload_guard(user_id):
+                    await asyncio.to_thread(_rewrite_user_store, user_id, data, plan["drop_ids"], splits)
+                bytes_after = await asyncio.to_thread(folder_size, _store_folder(user_id))
+
+        if plan["drop_ids"]:
+            await asyncio.to_thread(_drop_small_store_index, user_id)
+            SEEN_HASH_CACHE.invalidate(user_id)
+            _bump_store_version(user_id)
+
+    stats = {
+        "uid": user_id,
+        "chunks_before": len(data["ids"]),
+        "chunks_after": len(data["ids"]) - len(plan["drop_ids"]) + (len(splits) if plan["drop_ids"] else 0),
+        "duplicates_dropped": plan["duplicates_dropped"],
+        "events_rolled_up": plan["events_rolled_up"],
+        "rollup_chunks_added": len(splits) if plan["drop_ids"] else 0,
+        "bytes_before": bytes_before,
+        "bytes_after": bytes_after,
+        "bytes_reclaimed": bytes_before - bytes_after,
+        "seconds": round(time.monotonic() - started, 3),
+    }
+    metrics.incr("compaction.runs")
+    metrics.incr("compaction.chunks_removed", stats["chunks_before"] - stats["chunks_after"])
+    metrics.incr("compaction.bytes_reclaimed", max(0, stats["bytes_reclaimed"]))
+    metrics.observe("compaction.seconds", stats["seconds"])
+    print(f"Compacted embeddings for user {user_id}: {stats}")
+
+    if plan["drop_ids"]:
+        BACKUP_SCHEDULER.mark_dirty(user_id)
+    return stats
+
+# Compacts users whose stores grew by COMPACTION_MIN_NEW_CHUNKS, at most once per COMPACTION_MIN_INTERVAL_SECONDS
+COMPACTION_SCHEDULER = CompactionScheduler(
+    compact_user_store,
+    min_interval_seconds=COMPACTION_MIN_INTERVAL_SECONDS,
+    min_new_chunks=COMPACTION_MIN_NEW_CHUNKS
+)
+
+def start_compaction_scheduler():
+    """Start the background loop that compacts grown user stores."""
+    return asyncio.create_task(COMPACTION_SCHEDULER.run_forever(COMPACTION_SWEEP_SECONDS))
+
 async def load_user_retriever(user_id: str):
     """
     Load a retriever for a given user's vectorstore.
@@ -175,92 +952,88 @@ async def load_user_retriever(user_id: str):
     Returns:
         VectorStoreRetriever: A retriever instance ready to use.
     """
-    if not os.path.exists(os.path.join(EMBEDDINGS_DIR, user_id)):
-        # No store yet → Try loading from azure Blob Storage and if still not there then build context from user data
-        print(f"No embeddings found for user when trying to load retriever {user_id}, creating a new store.")
-        try:
-            async with chroma_guard(user_id):
-                async with zip_file_upload_guard(user_id):
-                # Attempt to download and restore user embeddings
-                    res = download_and_restore_user_embeddings(user_id)
-        except Exception as e:
-            res = None # If the file doesn't exist, then just create an empty store
-        if res is None:
-            # Create with context that is built from user data
-            user_context = build_context_for_user(user_id)
-            print("user_context===", user_context)
-            user_context_docs = create_docs(user_context, "")
-            await create_embeddings_for_user(user_context_docs, user_id)
-    async with chroma_guard(user_id):
-        # Load the store - since we are using chroma_guard, we can be sure that no other process is trying to write to the same user's store at the same time
+    # Flush-on-read: docs still sitting in the write-behind buffer must be visible to this retrieval
+    try:
+        await flush_pending_embeddings(user_id)
+    except Exception as e:
+        print(f"Error flushing pending embeddings for user {user_id} before retrieval: {e}")
+
+    await _ensure_user_store(user_id)
+    async with chroma_read_guard(user_id):
+        # Load the store - the shared guard lets retrievals run together while no writer holds the user's store
         store = _get_store(user_id)
-        return store.as_retriever()
+        # Small stores are answered by a brute-force NumPy index, bigger ones by Chroma's HNSW index
+        retriever = await asyncio.to_thread(_small_store_retriever, store, user_id)
+        if retriever is None:
+            retriever = _user_retriever(store, user_id)
+        # Repeated queries (e.g. the fixed quote and story prompts) are answered from the retrieval cache
+        return CachedRetriever(
+            retriever=retriever,
+            cache=RETRIEVAL_CACHE,
+            uid=user_id,
+            store_version=_store_versions.get(user_id, 0)
+        )
 
 
 def create_retriever(context_doc_list):
     if len(context_doc_list) == 0:
         return MongoDBAtlasVectorSearch(
             collection=ragEmbeddingsCollection,
-            embedding=OpenAIEmbeddings(api_key=OPENAI_API_KEY),
+            embedding=EMBEDDING,
             index_name=ATLAS_VECTOR_SEARCH_INDEX_NAME,
             relevance_score_fn="cosine"
         ).as_retriever()
     vstore = MongoDBAtlasVectorSearch.from_documents(
     documents=context_doc_list,
-    embedding=OpenAIEmbeddings(api_key=OPENAI_API_KEY, disallowed_special=()), 
+    embedding=ATLAS_EMBEDDING, 
     collection=ragEmbeddingsCollection, 
     index_name=ATLAS_VECTOR_SEARCH_INDEX_NAME
     )
 
     return vstore.as_retriever()
 
-def load_model(retriever, chat_history=[], flow={}):
-    llm = ChatOpenAI(api_key=OPENAI_API_KEY, model="gpt-4o-mini")
-
-    if flow.get('name', '') == 'quote_flow':
-        print("Loading model for quote flow")
-        system_prompt = model_prompts.QUOTE_MODEL_PROMPT + '\n' + flow.get('context', '')
+# System prompt of each load_model flow. The talk flow also takes the user's message and
+# the session history; the others only their per-request context.
+FLOW_PROMPTS = {
+    'talk': model_prompts.TALK_MODEL_PROMPT,
+    'quote_flow': model_prompts.QUOTE_MODEL_PROMPT,
+    'recommendation_flow': model_prompts.RECCOMMENDATION_MODEL_PROMPT,
+    'tag_selection_flow': model_prompts.TAG_SELECTION_MODEL_PROMPT,
+    'recommendation_context_flow': model_prompts.RECOMMENDATION_CONTEXT_MODEL_PROMPT,
+    'daily_story_flow': model_prompts.DAILY_STORY_MODEL_PROMPT,
+}
+TALK_FLOW = 'talk'
 
+def _build_flow_chain(name: str, llm):
+    """Prompt + stuff-documents chain of a flow; the dynamic parts stay template variables."""
+    if name == TALK_FLOW:
         model_contexts = [
-            ("system", system_prompt)
-        ]
-    elif flow.get('name', '') == 'recommendation_flow':
-        print("Loading model for recommendation flow")
-        system_prompt = model_prompts.RECCOMMENDATION_MODEL_PROMPT + '\n' + flow.get('context', '')
-        model_contexts = [
-            ("system", system_prompt)
-        ]
-    elif flow.get('name', '') == 'tag_selection_flow':
-        print("Loading model for tag selection flow")
-        system_prompt = model_prompts.TAG_SELECTION_MODEL_PROMPT + '\n' + flow.get('context', '')
-        model_contexts = [
-            ("system", system_prompt)
-        ]
-    elif flow.get('name', '') == 'recommendation_context_flow':
-        print("Loading model for recommendation context flow")
-        system_prompt = model_prompts.RECOMMENDATION_CONTEXT_MODEL_PROMPT + '\n' + flow.get('context', '')
-        model_contexts = [
-            ("system", system_prompt)
-        ]
-    elif flow.get('name', '') == 'daily_story_flow':
-        print("Loading model for story flow")
-        system_prompt = model_prompts.DAILY_STORY_MODEL_PROMPT + '\n' + flow.get('context', '')
-        model_contexts = [
-            ("system", system_prompt)
+            ("system", FLOW_PROMPTS[name] + "{chat_history}"),
+            ("human", "{input}"),
         ]
     else:
-        system_prompt = model_prompts.TALK_MODEL_PROMPT + f"{chat_history}"
-        
         model_contexts = [
-            ("system", system_prompt),
-            ("human", "{input}"),
+            ("system", FLOW_PROMPTS[name] + "\n{flow_context}")
         ]
+    return create_stuff_documents_chain(llm, ChatPromptTemplate.from_messages(model_contexts))
 
+# Built once: the LLM client, each flow's prompt template and its documents chain
+FLOW_LLM = get_chat_model("gpt-4o-mini")
+FLOW_CHAINS = {name: _build_flow_chain(name, FLOW_LLM) for name in FLOW_PROMPTS}
 
-    prompt = ChatPromptTemplate.from_messages(
-        model_contexts
-    )
+def load_model(retriever, chat_history=[], flow={}):
+    """
+    Return the retrieval chain of `flow['name']` (the talk flow if not given) over `retriever`,
+    with the request's chat history or flow context bound in. Unknown flow names raise ValueError.
+    """
+    name = flow.get('name') or TALK_FLOW
+    question_answer_chain = FLOW_CHAINS.get(name)
+    if question_answer_chain is None:
+        raise ValueError(f"Unknown flow '{name}', expected one of {sorted(FLOW_CHAINS)}")
 
-    question_answer_chain = create_stuff_documents_chain(llm, prompt)
+    if name == TALK_FLOW:
+        bound = {"chat_history": f"{chat_history}"}
+    else:
+        bound = {"flow_context": flow.get('context', '')}
     rag_chain = create_retrieval_chain(retriever, question_answer_chain)
-    return rag_chain
\ No newline at end of file
+    return RunnableLambda(lambda inputs: {**inputs, **bound}) | rag_chain
@@ -0,0 +1,39 @@
+# retrieval_cache.py  – caches retrieved documents per (uid, store version, query)
+import hashlib
+from typing import Any, List
+
+from langchain.docstore.document import Document
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.retrievers import BaseRetriever
+from pydantic import ConfigDict
+
+import metrics
+
+class CachedRetriever(BaseRetriever):
+    """
+    Wraps a user's retriever and answers repeated queries from `cache`.
+
+    Entries are keyed by (uid, store version, sha256(query)); the version is bumped on every
+    write to the user's store, so a write makes all earlier entries of that user unreachable.
+    A hit skips both the query embedding and the vector search.
+    """
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    retriever: Any
+    cache: Any
+    uid: str
+    store_version: int
+
+    def _cache_key(self, query: str) -> str:
+        return f"{self.uid}:{self.store_version}:{hashlib.sha256(query.encode('utf-8')).hexdigest()}"
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        key = self._cache_key(query)
+        docs = self.cache.get(key)
+        if docs is None:
+            with metrics.timer("retrieval_cache.miss_retrieval_seconds"):
+                docs = self.retriever.invoke(query, config={"callbacks": run_manager.get_child()})
+            self.cache.put(key, docs)
+        # Callers get their own copies so nothing they do leaks into the cached entry
+        return [doc.model_copy(deep=True) for doc in docs]
@@ -1,6 +1,10 @@
 
 import uuid
-from fastapi import APIRouter
+import metrics
+import locks
+from config import DEBUG_ENDPOINTS_ENABLED
+from llm_runner import LLM_RUNNER
+from fastapi import APIRouter, HTTPException
 
 router = APIRouter()
 
@@ -13,4 +17,40 @@ async def generate_session_id():
     Returns:
         dict: A dictionary containing the generated session ID.
     """
-    return {"session_id": str(uuid.uuid4())}
\ No newline at end of file
+    return {"session_id": str(uuid.uuid4())}
+
+@router.get("/metrics")
+async def get_metrics():
+    """
+    Endpoint to expose process metrics (cache hit rates, latencies, queue depths).
+    
+    Returns:
+        dict: Counters, gauges, timing summaries and histograms recorded by this process.
+    """
+    return metrics.snapshot()
+
+@router.get("/locks")
+async def get_held_locks():
+    """
+    Debug endpoint listing the store locks held right now in this process.
+    Only served when DEBUG_ENDPOINTS_ENABLED is set.
+    
+    Returns:
+        dict: Each held lock with its redacted key, kind, holder task and how long it has been held.
+    """
+    if not DEBUG_ENDPOINTS_ENABLED:
+        raise HTTPException(status_code=404, detail="Not Found")
+    return locks.held_locks()
+
+@router.get("/llm")
+async def get_llm_flows():
+    """
+    Debug endpoint showing the LLM calls running and queued per flow in this process.
+    Only served when DEBUG_ENDPOINTS_ENABLED is set.
+    
+    Returns:
+        dict: For each flow, its concurrency limit and its running and waiting calls.
+    """
+    if not DEBUG_ENDPOINTS_ENABLED:
+        raise HTTPException(status_code=404, detail="Not Found")
+    return LLM_RUNNER.stats()
@@ -19,6 +19,22 @@ async def talk_session_route(talk_data: TalkDTO):
     user_input = talk_data.user_input if talk_data.user_input else ""
     return await talk.mindwave_talk_session(uid, session_id, user_input)
 
+@router.post("/talk-session/stream")
+async def talk_session_stream_route(talk_data: TalkDTO):
+    """
+    Streaming variant of the talk session endpoint.
+    
+    Args:
+        talk_data (TalkDTO): Data transfer object containing user_id, session_id, and user_input.
+    Returns:
+        Server-Sent Events: a "session" event, one "token" event per generated token, then a
+        "done" event with the full response (or an "error" event).
+    """
+    uid = talk_data.user_id
+    session_id = talk_data.session_id
+    user_input = talk_data.user_input if talk_data.user_input else ""
+    return await talk.mindwave_talk_session_stream(uid, session_id, user_input)
+
 @router.get("/{uid}/personalized-quote")
 async def personalized_quote(uid: str):
     """
@@ -5,6 +5,7 @@ from core import userActions, background_tasks
 from datetime import datetime
 import uuid
 import asyncio
+from llm_runner import LLM_TIMEOUT_MESSAGE
 
 async def assessment_logic(assessment_details: AssessmentDTO):
     """
@@ -43,7 +44,10 @@ async def assessment_logic(assessment_details: AssessmentDTO):
     # Initialize session state if not already set
     await asyncio.to_thread(userActions.add_user_session, user_id, session_id, "assessment_"+test_option,test_config)
 
-    output = await asyncio.to_thread(chatbot.MindWavebot, uid = user_id, session_id = session_id, message = user_input, system_template=sys_template)
+    try:
+        output = await chatbot.MindWavebot(uid = user_id, session_id = session_id, message = user_input, system_template=sys_template)
+    except asyncio.TimeoutError:
+        return {"error": LLM_TIMEOUT_MESSAGE, "session_id": session_id}
 
     asyncio.create_task(background_tasks.update_user_embeddings(
         {"user_input": user_input, "response": output},
@@ -89,7 +93,10 @@ async def asessment_result_logic(assessment_data_for_prediction: AssessmenPredic
 
     data_extracted_str = utils.dict_to_string(data_extracted)
 
-    report = await asyncio.to_thread(chatbot.MindwaveReportBot,uid = user_id, session_id = session_id, prediction = prediction, required_info = input_info, curr_test=test_option, data_extracted=data_extracted_str, previous_report=previous_report)
+    try:
+        report = await chatbot.MindwaveReportBot(uid = user_id, session_id = session_id, prediction = prediction, required_info = input_info, curr_test=test_option, data_extracted=data_extracted_str, previous_report=previous_report)
+    except asyncio.TimeoutError:
+        return {'message': LLM_TIMEOUT_MESSAGE, 'status_code': 504}
     await asyncio.to_thread(userActions.add_report_to_db, user_id,test_option, session_id, report)
 
     asyncio.create_task(background_tasks.update_user_embeddings(
@@ -1,8 +1,13 @@
 from core import talksSessions, userActions,background_tasks
+from fastapi.responses import StreamingResponse
 import utils
 import uuid
+import json
+import time
 from datetime import datetime
 import asyncio
+import metrics
+from llm_runner import LLM_TIMEOUT_MESSAGE
 
 async def mindwave_talk_session(uid: str, session_id: str, user_input: str = ""):
     if not uid or uid == "":
@@ -15,7 +20,12 @@ async def mindwave_talk_session(uid: str, session_id: str, user_input: str = "")
     
     context_doc_list = None # talksSessions.get_context_doc_list(userActions.build_context_for_user(uid), session_id)
 
-    output = await talksSessions.talkToMe(uid, session_id, user_input, context_doc_list=context_doc_list)
+    try:
+        with metrics.timer("talk.response_seconds"):
+            output = await talksSessions.talkToMe(uid, session_id, user_input, context_doc_list=context_doc_list)
+    except asyncio.TimeoutError:
+        return {"error": LLM_TIMEOUT_MESSAGE, "session_id": session_id, "uid": uid}
+    talksSessions.record_first_response(uid)
 
     if context_doc_list is not None:
         # Then remove the embedding from mongo since its what we used to create the context
@@ -31,6 +41,63 @@ async def mindwave_talk_session(uid: str, session_id: str, user_input: str = "")
 
     return {"response": output, "session_id": session_id, "uid": uid}
 
+def _sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+async def _talk_session_events(uid: str, session_id: str, user_input: str):
+    started = time.monotonic()
+    first_token_at = None
+    output_parts = []
+    yield _sse_event("session", {"session_id": session_id, "uid": uid})
+    try:
+        async for token in talksSessions.talkToMeStream(uid, session_id, user_input):
+            if first_token_at is None:
+                first_token_at = time.monotonic()
+                metrics.observe("talk.stream.first_token_seconds", first_token_at - started)
+                talksSessions.record_first_response(uid)
+            output_parts.append(token)
+            yield _sse_event("token", {"token": token})
+    except asyncio.CancelledError:
+        # Client went away mid answer: the user's message is saved, the partial answer is not
+        metrics.incr("talk.stream.disconnects")
+        raise
+    except asyncio.TimeoutError:
+        yield _sse_event("error", {"error": LLM_TIMEOUT_MESSAGE})
+        return
+    except Exception as e:
+        metrics.incr("talk.stream.errors")
+        print(f"Error streaming talk session for user {uid}: {e}")
+        yield _sse_event("error", {"error": "Something went wrong, please try again"})
+        return
+    metrics.observe("talk.stream.total_seconds", time.monotonic() - started)
+
+    output = "".join(output_parts)
+    asyncio.create_task(background_tasks.update_user_embeddings(
+        {"user_input": user_input, "response": output},
+        uid,
+        meta_data={"talk session date": datetime.now().isoformat()},
+        session_id=session_id,
+        title="Talk Session Data"
+    ))
+    yield _sse_event("done", {"response": output, "session_id": session_id, "uid": uid})
+
+async def mindwave_talk_session_stream(uid: str, session_id: str, user_input: str = ""):
+    """Streaming variant of mindwave_talk_session: the answer is sent as Server-Sent Events while it is generated."""
+    if not uid or uid == "":
+        return {"error": "Please sign up/login to continue"}
+
+    if not session_id or session_id == "":
+        session_id = str(uuid.uuid4())
+
+    userActions.add_user_session(uid, session_id, "talk_session", {})
+
+    return StreamingResponse(
+        _talk_session_events(uid, session_id, user_input),
+        media_type="text/event-stream",
+        # Stop proxies from buffering the stream
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 async def get_personalized_quote(uid: str):
     if not uid or uid == "":
         return {"error": "Please sign up/login to continue"}
@@ -49,9 +116,13 @@ async def get_personalized_quote(uid: str):
     else:
         previous_quotes = "No previous quotes available."
 
-    quote = await talksSessions.giveMeAQuoute(uid, previous_quotes)
+    try:
+        quote = await talksSessions.giveMeAQuoute(uid, previous_quotes)
+    except asyncio.TimeoutError:
+        return {"error": LLM_TIMEOUT_MESSAGE}
     if not quote:
         return {"error": "No quotes available at the moment"}
+    talksSessions.record_first_response(uid)
 
     #  Add the quote to the database for the user
     userActions.add_daily_quote(uid, quote['quote'])
@@ -80,9 +151,13 @@ async def get_daily_story(uid: str):
     else:
         previous_stories_text = "No previous stories available."
 
-    story = await talksSessions.giveMeAStory(uid, previous_stories_text)
+    try:
+        story = await talksSessions.giveMeAStory(uid, previous_stories_text)
+    except asyncio.TimeoutError:
+        return {"error": LLM_TIMEOUT_MESSAGE}
     if not story:
         return {"error": "No stories available at the moment"}
+    talksSessions.record_first_response(uid)
 
     # Add the story to the database for the user
     userActions.add_daily_story(uid, story.get('story'))
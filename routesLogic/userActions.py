@@ -34,6 +34,8 @@ async def login_user(login_cred):
     
     resp = userActions.login(login_cred)
     if resp["status_code"] == 200:
+        # Warm the user's embeddings store now so their first talk/quote request does not wait on a restore
+        background_tasks.warm_user_embeddings(resp.get("uid", "default_user"))
         # Start a background task to update user embeddings with login details - pass the user login count also to be able to know if to start generating recommendations
         asyncio.create_task(background_tasks.run_sequenced_user_login_tasks(
             uid=resp.get("uid", "default_user"),
@@ -54,6 +56,8 @@ async def hackathon_username_only_authentication(username: str, short_bio: str =
             # If login count is less than   , initialize user embeddings
             asyncio.create_task(background_tasks.init_user_embeddings(resp.get("user_details", {})))
         else:
+            # Returning user - warm their embeddings store now so their first talk/quote request does not wait on a restore
+            background_tasks.warm_user_embeddings(resp.get("uid", "default_user"))
             # If login count is more than 1, just update the user embeddings
             asyncio.create_task(background_tasks.run_sequenced_user_login_tasks(
                 uid=resp.get("uid", "default_user"),
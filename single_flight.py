@@ -0,0 +1,38 @@
+# single_flight.py  – collapses concurrent calls for the same key into one in-flight call
+import asyncio
+
+import metrics
+
+class SingleFlight:
+    """
+    Runs at most one `fn()` per key at a time; callers arriving while it runs await the same result.
+
+    The call runs as its own task, so a caller that gives up (e.g. a cancelled request)
+    does not cancel the work the other callers are waiting on. Errors reach every caller.
+    Leader/joined counters are published through `metrics` under `name.*`.
+    """
+
+    def __init__(self, name: str = "single_flight"):
+        self.name = name
+        self._flights: dict[str, asyncio.Task] = {}
+
+    def in_flight(self, key: str) -> bool:
+        return key in self._flights
+
+    async def do(self, key: str, fn):
+        """Run `fn()` (a coroutine function) for `key`, or join the call already running for it."""
+        task = self._flights.get(key)
+        if task is None:
+            task = asyncio.create_task(fn())
+            self._flights[key] = task
+            task.add_done_callback(lambda done, key=key: self._forget(key, done))
+            metrics.incr(f"{self.name}.leaders")
+        else:
+            metrics.incr(f"{self.name}.joined")
+        return await asyncio.shield(task)
+
+    def _forget(self, key: str, task: asyncio.Task):
+        if self._flights.get(key) is task:
+            del self._flights[key]
+        if not task.cancelled() and task.exception() is not None:
+            metrics.incr(f"{self.name}.errors")
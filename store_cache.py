@@ -0,0 +1,88 @@
+# store_cache.py  – process-wide LRU of open per-user vector store handles (and other per-key values)
+import threading
+import time
+from collections import OrderedDict
+
+import metrics
+
+class StoreCache:
+    """
+    Bounded LRU of open vector store handles keyed by uid (or of any value keyed by a string).
+
+    Entries that have not been touched for `idle_seconds` are dropped lazily on the
+    next access, and the least recently used entry is dropped once `max_size` is hit.
+    Hit/miss/eviction counters are published through `metrics` under `name.*`.
+    """
+
+    def __init__(self, max_size: int = 128, idle_seconds: float = 900.0, name: str = "store_cache"):
+        self.max_size = max(1, max_size)
+        self.idle_seconds = idle_seconds
+        self.name = name
+        self._entries: OrderedDict[str, tuple[object, float]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _count(self, event: str, value: int = 1):
+        metrics.incr(f"{self.name}.{event}", value)
+
+    def _evict_idle_locked(self, now: float) -> int:
+        if self.idle_seconds <= 0:
+            return 0
+        expired = [uid for uid, (_, last_used) in self._entries.items() if now - last_used > self.idle_seconds]
+        for uid in expired:
+            del self._entries[uid]
+        return len(expired)
+
+    def _publish_size_locked(self):
+        metrics.set_gauge(f"{self.name}.size", len(self._entries))
+
+    def get(self, uid: str):
+        """Return the cached handle for `uid` (refreshing its recency) or None."""
+        now = time.monotonic()
+        with self._lock:
+            expired = self._evict_idle_locked(now)
+            entry = self._entries.get(uid)
+            if entry is not None:
+                self._entries[uid] = (entry[0], now)
+                self._entries.move_to_end(uid)
+            self._publish_size_locked()
+
+        if expired:
+            self._count("idle_evictions", expired)
+        self._count("hits" if entry is not None else "misses")
+        return entry[0] if entry is not None else None
+
+    def put(self, uid: str, store):
+        """Cache `store` as the warm handle for `uid`, evicting the LRU entry if full."""
+        now = time.monotonic()
+        with self._lock:
+            expired = self._evict_idle_locked(now)
+            self._entries[uid] = (store, now)
+            self._entries.move_to_end(uid)
+            evicted = 0
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                evicted += 1
+            self._publish_size_locked()
+
+        if expired:
+            self._count("idle_evictions", expired)
+        if evicted:
+            self._count("lru_evictions", evicted)
+
+    def invalidate(self, uid: str) -> bool:
+        """Drop the handle for `uid` (e.g. when its store is rebuilt or deleted)."""
+        with self._lock:
+            removed = self._entries.pop(uid, None) is not None
+            self._publish_size_locked()
+        if removed:
+            self._count("invalidations")
+        return removed
+
+    def stats(self) -> dict:
+        """Return the current size and limits of the cache."""
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "idle_seconds": self.idle_seconds,
+            }
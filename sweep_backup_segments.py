@@ -0,0 +1,19 @@
+"""
+Delete backup segments nobody references any more from the shared legacy segment namespace.
+
+Usage:
+    python sweep_backup_segments.py [--dry-run]
+
+Backups written before segments were kept per user stored every user's segments straight
+under "segments/"; those are never deleted by later backups. Run this once old backups have
+been replaced (each user's next backup moves them to their own prefix), and again at will.
+"""
+import argparse
+
+from incremental_backup import sweep_legacy_segments
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Delete unreferenced legacy backup segments.")
+    parser.add_argument("--dry-run", action="store_true", help="Only count what would be deleted")
+    args = parser.parse_args()
+    print(sweep_legacy_segments(dry_run=args.dry_run))
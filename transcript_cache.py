@@ -0,0 +1,90 @@
+# transcript_cache.py  – per-session, append-only cache of chat transcripts (Mongo stays the source of truth)
+import threading
+
+import metrics
+from store_cache import StoreCache
+
+class TranscriptCache:
+    """
+    Holds the messages of active chat sessions, keyed by session, in a bounded LRU with an idle TTL.
+
+    A transcript is loaded from the database on first access and then kept current by
+    `append`, called after each message is written, so later turns read no messages back.
+    Messages written by another worker process never reach `append`, so callers pass the
+    message count stored with the session and a cached transcript of another length is
+    read again. Transcripts longer than `max_messages` are not cached. A message written while its
+    transcript is being loaded marks that load stale, so it is not cached without the message.
+    """
+
+    def __init__(self, max_sessions: int = 1024, idle_seconds: float = 900.0, max_messages: int = 500, name: str = "transcript_cache"):
+        self.max_messages = max(1, max_messages)
+        self.name = name
+        self._cache = StoreCache(max_size=max_sessions, idle_seconds=idle_seconds, name=name)
+        # key -> True once a message was written while the key was being loaded
+        self._loading: dict[str, bool] = {}
+        self._lock = threading.Lock()
+
+    def _cached_locked(self, key: str, expected_length: int = None):
+        transcript = self._cache.get(key)
+        if transcript is None:
+            return None
+        if expected_length is not None and len(transcript) != expected_length:
+            metrics.incr(f"{self.name}.length_mismatches")
+            self._cache.invalidate(key)
+            return None
+        return [dict(message) for message in transcript]
+
+    def get(self, key: str, expected_length: int = None):
+        """Return (copies of) the cached transcript for `key`, or None if it is not cached (or not `expected_length` long)."""
+        with self._lock:
+            return self._cached_locked(key, expected_length)
+
+    def load(self, key: str, loader, expected_length: int = None) -> list[dict]:
+        """
+        Return (copies of) the transcript for `key`, calling `loader()` to read it on a miss or
+        when the cached one does not have `expected_length` messages.
+        """
+        with self._lock:
+            transcript = self._cached_locked(key, expected_length)
+            if transcript is not None:
+                return transcript
+            self._loading.setdefault(key, False)
+
+        try:
+            messages = [dict(message) for message in loader()]
+        except Exception:
+            with self._lock:
+                self._loading.pop(key, None)
+            raise
+
+        with self._lock:
+            # Popped by a concurrent load of the same key: let that one decide, don't cache twice
+            stale = self._loading.pop(key, True)
+            if stale:
+                metrics.incr(f"{self.name}.stale_loads")
+            elif len(messages) <= self.max_messages:
+                self._cache.put(key, [dict(message) for message in messages])
+        return messages
+
+    def append(self, key: str, message: dict):
+        """Add a message that was just written to the database to the cached transcript, if any."""
+        with self._lock:
+            if key in self._loading:
+                self._loading[key] = True
+            transcript = self._cache.get(key)
+            if transcript is None:
+                return
+            if len(transcript) >= self.max_messages:
+                # Too long to keep, it is read from the database again from now on
+                self._cache.invalidate(key)
+                return
+            transcript.append(dict(message))
+
+    def invalidate(self, key: str) -> bool:
+        with self._lock:
+            if key in self._loading:
+                self._loading[key] = True
+            return self._cache.invalidate(key)
+
+    def stats(self) -> dict:
+        return self._cache.stats()
@@ -4,8 +4,9 @@ from core import chatActions, mental_prediction, big5_personality
 import pandas as pd
 import re
 import json
-from azure.storage.blob import BlobServiceClient, ContentSettings
-from config import AZURE_BLOB_CONNECTION_STR, EMBEDDINGS_CONTAINER_NAME
+import io
+from blob_storage import get_blob_container, BlobRangeReader
+from config import EMBEDDINGS_CONTAINER_NAME, BLOB_STREAM_CHUNK_SIZE
 
 POSSIBLE_SELECTIONS = {
     "mindlab": mental_prediction,
@@ -207,34 +208,13 @@ def remove_embedded_data(session_id:str):
 
 def upload_file_bytes(blob_name, file_bytes, content_type="application/octet-stream", container_name=EMBEDDINGS_CONTAINER_NAME,):
     try:
-        blob_service_client = BlobServiceClient.from_connection_string(
-            AZURE_BLOB_CONNECTION_STR
-        )
-        
-        container_client = blob_service_client.get_container_client(
-            container_name
-        )
-
-        blob_client = container_client.get_blob_client(blob_name)
-
-        # Explicitly delete if exists - comment out to avoid concurency issues where another process might be trying to access the same blob but cannot because it is being deleted
-        # if blob_client.exists():
-        #     blob_client.delete_blob()
+        container = get_blob_container(container_name)
 
-        content_settings = ContentSettings(
-            content_type=content_type,
-            content_disposition="inline",
-        )
-
-        blob_client.upload_blob(
-            file_bytes,
-            overwrite=True,
-            blob_type="BlockBlob",
-            content_settings=content_settings,
-        )
+        # Uploads overwrite in place - no explicit delete, to avoid concurency issues where another process might be trying to access the same blob but cannot because it is being deleted
+        container.upload_bytes(blob_name, file_bytes, content_type=content_type)
 
         print(f"File {blob_name} uploaded successfully.")
-        return blob_client.url
+        return container.url(blob_name)
 
     except Exception as ex:
         print(f"Error during file upload: {ex}")
@@ -242,24 +222,50 @@ def upload_file_bytes(blob_name, file_bytes, content_type="application/octet-str
 
 def download_file_bytes(blob_name, container_name=EMBEDDINGS_CONTAINER_NAME):
     try:
-        blob_service_client = BlobServiceClient.from_connection_string(
-            AZURE_BLOB_CONNECTION_STR
-        )
-        
-        container_client = blob_service_client.get_container_client(
-            container_name
-        )
-
-        blob_client = container_client.get_blob_client(blob_name)
+        container = get_blob_container(container_name)
 
-        if not blob_client.exists():
+        if not container.exists(blob_name):
             print(f"Blob {blob_name} does not exist.")
             return None
 
-        file_bytes = blob_client.download_blob().readall()
+        file_bytes = b"".join(container.iter_chunks(blob_name))
         print(f"File {blob_name} downloaded successfully.")
         return file_bytes
 
     except Exception as ex:
         print(f"Error during file download: {ex}")
         raise
+
+def delete_file(blob_name, container_name=EMBEDDINGS_CONTAINER_NAME):
+    """Delete a blob (no error if it is already gone)."""
+    try:
+        get_blob_container(container_name).delete(blob_name)
+    except Exception as ex:
+        print(f"Error during file delete: {ex}")
+        raise
+
+def list_file_names(prefix="", container_name=EMBEDDINGS_CONTAINER_NAME):
+    """Names of the blobs starting with `prefix`."""
+    try:
+        return list(get_blob_container(container_name).list_names(prefix))
+    except Exception as ex:
+        print(f"Error listing files: {ex}")
+        raise
+
+def open_blob_reader(blob_name, chunk_size=BLOB_STREAM_CHUNK_SIZE, container_name=EMBEDDINGS_CONTAINER_NAME):
+    """
+    Open a seekable reader over a blob that downloads `chunk_size` byte ranges on demand.
+    Returns None if the blob does not exist.
+    """
+    try:
+        container = get_blob_container(container_name)
+
+        if not container.exists(blob_name):
+            print(f"Blob {blob_name} does not exist.")
+            return None
+
+        return io.BufferedReader(BlobRangeReader(container, blob_name, chunk_size), buffer_size=chunk_size)
+
+    except Exception as ex:
+        print(f"Error opening blob reader: {ex}")
+        raise
@@ -0,0 +1,107 @@
+# write_behind.py  – per-user write-behind buffer that coalesces embedding updates
+import asyncio
+from collections import defaultdict
+
+import metrics
+
+class WriteBehindBuffer:
+    """
+    Gathers documents per uid and hands them to `flush_fn(uid, docs)` as one batch.
+
+    A uid's buffer is flushed `window_seconds` after its first pending doc arrives, or
+    straight away once it holds `max_docs` docs. `flush(uid)` can also be awaited by
+    readers so they see everything that was written before them. A failed flush keeps its
+    docs and is retried by a timer, backing off up to `max_retry_seconds`.
+    """
+
+    def __init__(self, flush_fn, window_seconds: float = 2.0, max_docs: int = 16, max_retry_seconds: float = 60.0):
+        self.flush_fn = flush_fn
+        self.window_seconds = window_seconds
+        self.max_docs = max(1, max_docs)
+        self.max_retry_seconds = max_retry_seconds
+        self._pending: dict[str, list] = defaultdict(list)
+        self._timers: dict[str, asyncio.Task] = {}
+        # uid -> [lock, number of holders and waiters]; dropped once nobody uses it
+        self._flush_locks: dict[str, list] = {}
+        # uid -> consecutive failed flushes
+        self._failures: dict[str, int] = {}
+
+    def pending_count(self, uid: str = None) -> int:
+        if uid is not None:
+            return len(self._pending.get(uid, []))
+        return sum(len(docs) for docs in self._pending.values())
+
+    def _publish_depth(self):
+        metrics.set_gauge("write_behind.pending_docs", self.pending_count())
+
+    async def add(self, uid: str, docs: list):
+        """Buffer `docs` for `uid`, flushing right away if the size threshold is reached."""
+        if not docs:
+            return
+        self._pending[uid].extend(docs)
+        metrics.incr("write_behind.docs_buffered", len(docs))
+        self._publish_depth()
+
+        if len(self._pending[uid]) >= self.max_docs or self.window_seconds <= 0:
+            await self.flush(uid)
+        elif uid not in self._timers:
+            self._timers[uid] = asyncio.create_task(self._flush_later(uid))
+
+    async def _flush_later(self, uid: str, delay: float = None):
+        await asyncio.sleep(self.window_seconds if delay is None else delay)
+        self._timers.pop(uid, None)
+        try:
+            await self.flush(uid)
+        except Exception as e:
+            print(f"Error flushing buffered embeddings for user {uid}: {e}")
+
+    def _schedule_retry(self, uid: str):
+        failures = self._failures[uid] = self._failures.get(uid, 0) + 1
+        if uid in self._timers:
+            return
+        delay = min(max(self.window_seconds, 1.0) * 2 ** (failures - 1), self.max_retry_seconds)
+        self._timers[uid] = asyncio.create_task(self._flush_later(uid, delay))
+        metrics.incr("write_behind.retries_scheduled")
+
+    async def flush(self, uid: str):
+        """Write every buffered doc for `uid`; waits for an in-flight flush of the same user."""
+        entry = self._flush_locks.get(uid)
+        if entry is None:
+            entry = self._flush_locks[uid] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                await self._flush_pending(uid)
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0 and self._flush_locks.get(uid) is entry:
+                del self._flush_locks[uid]
+
+    async def _flush_pending(self, uid: str):
+        docs = self._pending.pop(uid, [])
+        self._publish_depth()
+        if not docs:
+            return
+        try:
+            await self.flush_fn(uid, docs)
+        except Exception:
+            # Keep the docs (ahead of anything newer) and retry them later, even if nothing else arrives
+            self._pending[uid][:0] = docs
+            self._publish_depth()
+            metrics.incr("write_behind.flush_errors")
+            self._schedule_retry(uid)
+            raise
+        self._failures.pop(uid, None)
+        metrics.incr("write_behind.flushes")
+        metrics.incr("write_behind.docs_flushed", len(docs))
+
+    async def flush_all(self):
+        """Flush every user with pending docs (used on shutdown)."""
+        for timer in self._timers.values():
+            timer.cancel()
+        self._timers.clear()
+        for uid in list(self._pending.keys()):
+            try:
+                await self.flush(uid)
+            except Exception as e:
+                print(f"Error flushing buffered embeddings for user {uid}: {e}")